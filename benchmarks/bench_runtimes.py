@@ -0,0 +1,101 @@
+"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+⏱ RUNTIME BENCHMARK: TeleBot threads vs AsyncTeleBot
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+Replays a storm of deep-link /start updates against a fake Bot API with a
+fixed per-call latency and reports deliveries per second for each runtime.
+
+    python benchmarks/bench_runtimes.py --updates 1000 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_api import StubBotAPI  # noqa: E402
+
+
+def deep_link_updates(first_uid, count, codes):
+    updates = []
+    for i in range(count):
+        uid = first_uid + i
+        text = f"/start {codes[i % len(codes)]}"
+        updates.append({
+            "update_id": uid,
+            "message": {"message_id": i + 1, "date": 0, "text": text,
+                        "chat": {"id": uid, "type": "private"},
+                        "from": {"id": uid, "is_bot": False, "first_name": "bench"},
+                        "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}})
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Bot API latency per call (s)")
+    parser.add_argument("--threads", type=int, default=8, help="TeleBot worker threads")
+    parser.add_argument("--files", type=int, default=50, help="distinct codes to request")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="filestore-bench-"))
+    os.environ.update(BOT_TOKEN="123:bench", BIN_CHANNEL="-100", WORKER_THREADS=str(args.threads),
+                      API_GLOBAL_RATE=os.environ.get("API_GLOBAL_RATE", "0"))
+
+    api = StubBotAPI(latency=args.latency).start()
+    api.install()
+    import main as app
+
+    codes = [f"bench{i:03d}" for i in range(args.files)]
+    for i, code in enumerate(codes):
+        app.db.add_file(code, f"file{i}.pdf", "application/pdf", f"F{i}", f"U{i}", i + 1, -100, 1)
+
+    results = {}
+
+    # 1. Threaded TeleBot
+    from telebot import types
+    batch = [types.Update.de_json(u) for u in deep_link_updates(1_000_000, args.updates, codes)]
+    api.reset()
+    t0 = time.perf_counter()
+    app.bot.process_new_updates(batch)
+    api.wait_for("copyMessage", args.updates)
+    results["threads"] = time.perf_counter() - t0
+
+    # 2. AsyncTeleBot
+    try:
+        runtime = app.AsyncRuntime(app.BOT_TOKEN, app.DB_POOL_SIZE, app.ASYNC_MAX_INFLIGHT, app.ASYNC_HTTP_LIMIT)
+    except SystemExit:
+        runtime = None
+        print("⚠️ aiohttp not installed: skipping the async runtime")
+
+    if runtime:
+        async def run_async():
+            await runtime.setup()
+            api.reset()
+            for update in deep_link_updates(2_000_000, args.updates, codes):
+                api.push_update(update)  # through getUpdates, like production
+            t0 = time.perf_counter()
+            poller = asyncio.create_task(runtime.poll(timeout=1))
+            await asyncio.get_running_loop().run_in_executor(None, api.wait_for, "copyMessage", args.updates)
+            elapsed = time.perf_counter() - t0
+            poller.cancel()
+            await runtime.drain()
+            await runtime.abot.close_session()
+            return elapsed
+        results["async"] = asyncio.run(run_async())
+
+    print(f"\n📊 {args.updates} deep links | API latency {args.latency * 1000:.0f} ms | {args.threads} threads")
+    print("▬" * 48)
+    for name, elapsed in results.items():
+        print(f"{name:<8} {elapsed:8.2f}s  {args.updates / elapsed:10.1f} updates/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🏋️ OFFLINE LOAD TEST (fake Bot API + real main.py)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+Runs the bot exactly as deployed (long polling, worker threads, SQLite on
+disk) against benchmarks/stub_api.py and drives scripted workloads:
+
+    deeplinks   /start <code> storm over a set of hot codes
+    uploads     documents from distinct users
+    albums      10-item media groups
+    broadcast   one broadcast over --broadcast-users users
+    stats       admin "📊 Statistics" taps over a --files sized table
+    mixed       deep links arriving behind an upload burst (delivery latency)
+    paced       the outbound scheduler's production limits: users bursting deep links up to
+                the flood-control limit and uploads into a 429ing storage channel, while
+                other users trickle in single deep links (their latency is reported)
+
+    python benchmarks/load_test.py --scenarios deeplinks,uploads --updates 2000 --latency 0.02
+
+Latency is measured from the moment an update is handed to getUpdates to
+the last Bot API call the handler makes for that chat. "lost" counts
+updates that never got their final reply (e.g. a 429 the bot didn't retry).
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_api import StubBotAPI  # noqa: E402
+
+ADMIN_BASE = 9_000_000_000
+USER_BASE = 1_000_000
+
+
+def percentile(values, q):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def message(uid, **fields):
+    msg = {"message_id": fields.pop("message_id", 1), "date": int(time.time()),
+           "chat": {"id": uid, "type": "private"},
+           "from": {"id": uid, "is_bot": False, "first_name": "load"}}
+    msg.update(fields)
+    return {"message": msg}
+
+
+def command(uid, text):
+    return message(uid, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}])
+
+
+def document(uid, unique, message_id=1, **extra):
+    return message(uid, message_id=message_id, document={
+        "file_id": f"F{unique}", "file_unique_id": unique, "file_name": f"{unique}.pdf",
+        "mime_type": "application/pdf"}, **extra)
+
+
+def callback(uid, data):
+    return {"callback_query": {"id": str(uid), "chat_instance": "load", "data": data,
+                               "from": {"id": uid, "is_bot": False, "first_name": "load"},
+                               "message": {"message_id": 1, "date": 0, "text": "panel",
+                                           "chat": {"id": uid, "type": "private"}}}}
+
+
+def db_figures(app):
+    """Sum/count of DB method time plus error and pool-wait counters from /metrics."""
+    text = app.metrics.render()
+
+    def total(pattern):
+        return sum(float(v) for v in re.findall(pattern + r"(?:\{[^}]*\})? ([0-9.e+-]+)", text))
+    return {"db_seconds": total(r"filestore_db_seconds_sum"), "db_calls": total(r"filestore_db_seconds_count"),
+            "db_errors": total(r"filestore_db_errors_total"), "pool_waits": total(r"filestore_db_pool_waits_total"),
+            "pool_wait_s": total(r"filestore_db_pool_wait_seconds_total")}
+
+
+class LoadTest:
+    def __init__(self, app, api, args):
+        self.app, self.api, self.args = app, api, args
+        self.results = []
+
+    # --- driving ---
+    def drive(self, name, updates, terminal, expected=None, background=(), pace=0.0):
+        """Feeds ``updates`` [(chat_id, update)] and waits for ``terminal`` calls to each chat.
+
+        ``background`` updates are pushed first and not waited for; ``pace`` spaces out ``updates``.
+        """
+        api, before = self.api, db_figures(self.app)
+        api.reset()
+        sent_at = {}
+        start = time.perf_counter()
+        for _, update in background:
+            api.push_update(update)
+        for chat_id, update in updates:
+            api.push_update(update)
+            sent_at.setdefault(chat_id, time.perf_counter())
+            if pace: time.sleep(pace)
+        expected = expected or len(sent_at)
+        done = api.wait_for(terminal, expected, timeout=self.args.timeout, stall=self.args.stall)
+        wall = time.perf_counter() - start
+        latencies = [api.last_call[(terminal, chat)] - t for chat, t in sent_at.items() if (terminal, chat) in api.last_call]
+        if done < expected:  # don't count the stall detection window
+            wall = max(api.last_call.values(), default=start) - start
+        self.report(name, len(updates), wall, latencies, before, lost=expected - done)
+
+    def report(self, name, count, wall, latencies, before, lost=0):
+        after = db_figures(self.app)
+        delta = {k: after[k] - before[k] for k in after}
+        self.results.append({
+            "scenario": name, "updates": count, "wall": wall, "rate": count / wall if wall else 0,
+            "p50": percentile(latencies, 0.50) * 1000, "p99": percentile(latencies, 0.99) * 1000,
+            "api_calls": sum(self.api.calls.values()), "429s": sum(self.api.floods.values()),
+            "db_ms_per_update": delta["db_seconds"] * 1000 / max(count, 1),
+            "db_errors": int(delta["db_errors"]), "pool_waits": int(delta["pool_waits"]), "lost": lost,
+        })
+
+    # --- scenarios ---
+    def deeplinks(self):
+        codes = [f"hot{i:05d}" for i in range(self.args.codes)]
+        self.app.db.add_files([(c, f"{c}.pdf", "application/pdf", f"F{c}", f"U{c}", i + 1, -100, 1)
+                               for i, c in enumerate(codes)])
+        updates = [(USER_BASE + i, command(USER_BASE + i, f"/start {codes[i % len(codes)]}"))
+                   for i in range(self.args.updates)]
+        self.drive("deeplinks", updates, "copyMessage")
+
+    def uploads(self):
+        base = USER_BASE * 2
+        updates = [(base + i, document(base + i, f"up{i}")) for i in range(self.args.updates)]
+        self.drive("uploads", updates, "editMessageText")
+
+    def albums(self):
+        base = USER_BASE * 3
+        updates = []
+        for g in range(max(1, self.args.updates // 10)):
+            uid = base + g
+            for part in range(10):
+                updates.append((uid, document(uid, f"al{g}_{part}", message_id=part + 1, media_group_id=f"g{g}")))
+        self.drive("albums", updates, "editMessageText")
+
+    def broadcast(self):
+        app, n = self.app, self.args.broadcast_users
+        with app.db.transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                             ((USER_BASE * 10 + i,) for i in range(n)))
+        total_users = app.db.get_system_stats()[0]
+        admin = ADMIN_BASE
+        app.ADMIN_LIST.append(admin)
+        before = db_figures(app)
+        self.api.reset()
+        start = time.perf_counter()
+        app.broadcasts.start(app.types.Message.de_json(message(admin, text="📢 load test")["message"]))
+        while app.db.get_running_broadcasts():
+            time.sleep(0.05)
+        job = app.db.fetchone("SELECT sent FROM broadcasts ORDER BY job_id DESC LIMIT 1")
+        self.report("broadcast", total_users, time.perf_counter() - start, [], before, lost=total_users - job[0])
+
+    def stats(self):
+        app, n = self.app, self.args.files
+        with app.db.transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO files (file_code, file_name, channel_id, uploader_id) VALUES (?,?,?,?)",
+                             ((f"st{i:07d}", f"f{i}", -100 - i % 5, i % 5000) for i in range(n)))
+        admins = [ADMIN_BASE + 1 + i for i in range(max(1, self.args.updates // 10))]
+        app.ADMIN_LIST.extend(admins)
+        self.drive("stats", [(a, callback(a, "adm_stats")) for a in admins], "editMessageText")
+
+    def mixed(self):
+        codes = [f"mix{i:05d}" for i in range(self.args.codes)]
+        self.app.db.add_files([(c, f"{c}.pdf", "application/pdf", f"F{c}", f"U{c}", i + 1, -100, 1)
+                               for i, c in enumerate(codes)])
+        base = USER_BASE * 4
+        burst = [(base + i, document(base + i, f"mx{i}")) for i in range(self.args.updates)]
+        base += self.args.updates
+        links = [(base + i, command(base + i, f"/start {codes[i % len(codes)]}"))
+                 for i in range(self.args.updates // 4)]
+        self.drive("mixed", links, "copyMessage", background=burst)
+        self.api.wait_for("editMessageText", len(burst), timeout=self.args.timeout, stall=self.args.stall)
+
+    def paced(self):
+        app, a = self.app, self.args
+        codes = [f"pc{i:05d}" for i in range(a.codes)]
+        app.db.add_files([(c, f"{c}.pdf", "application/pdf", f"F{c}", f"U{c}", i + 1, -100, 1)
+                          for i, c in enumerate(codes)])
+        base = USER_BASE * 5
+        bursts = [(base + u, command(base + u, f"/start {codes[(u + i) % len(codes)]}"))
+                  for u in range(a.burst_users) for i in range(app.FLOOD_DEEPLINK_BURST)]
+        base += a.burst_users
+        uploads = [(base + i, document(base + i, f"pc{i}")) for i in range(a.burst_users)]
+        base += a.burst_users
+        links = [(base + i, command(base + i, f"/start {codes[i % len(codes)]}")) for i in range(max(1, a.updates // 10))]
+
+        saved = app.outbound.global_bucket
+        app.outbound.global_bucket = app.TokenBucket(a.api_rate) if a.api_rate else None
+        self.api.throttle(app.BIN_CHANNEL, a.storage_throttle)
+        try:
+            self.drive("paced", links, "copyMessage", expected=len(links) + len(bursts),
+                       background=bursts + uploads, pace=1 / a.trickle_rate)
+            self.api.wait_for("editMessageText", len(uploads), timeout=a.timeout, stall=a.stall)
+        finally:
+            app.outbound.global_bucket = saved
+
+    # --- output ---
+    def print_report(self):
+        a = self.args
+        print(f"\n📊 Load test | API latency {a.latency * 1000:.0f} ms | 429 rate {a.flood_rate:.1%} | "
+              f"{a.threads} worker threads")
+        head = f"{'scenario':<10} {'updates':>8} {'wall s':>8} {'upd/s':>9} {'p50 ms':>8} {'p99 ms':>8} " \
+               f"{'api':>7} {'429':>5} {'lost':>5} {'db ms/upd':>9} {'db err':>6} {'pool wait':>9}"
+        print(head)
+        print("▬" * len(head))
+        for r in self.results:
+            print(f"{r['scenario']:<10} {r['updates']:>8} {r['wall']:>8.2f} {r['rate']:>9.1f} {r['p50']:>8.1f} "
+                  f"{r['p99']:>8.1f} {r['api_calls']:>7} {r['429s']:>5} {r['lost']:>5} {r['db_ms_per_update']:>9.3f} "
+                  f"{r['db_errors']:>6} {r['pool_waits']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="deeplinks,uploads,albums,broadcast,stats")
+    parser.add_argument("--updates", type=int, default=1000, help="updates per interactive scenario")
+    parser.add_argument("--codes", type=int, default=200, help="distinct hot codes for deeplinks")
+    parser.add_argument("--broadcast-users", type=int, default=100_000)
+    parser.add_argument("--files", type=int, default=200_000, help="files table size for stats")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Bot API latency per call (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of send calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8, help="WORKER_THREADS for the bot")
+    parser.add_argument("--api-rate", type=float, default=30, help="paced: global Bot API messages / second")
+    parser.add_argument("--burst-users", type=int, default=8, help="paced: users bursting deep links (and uploading)")
+    parser.add_argument("--trickle-rate", type=float, default=10, help="paced: single deep links / second")
+    parser.add_argument("--storage-throttle", type=float, default=3, help="paced: seconds the storage channel answers 429")
+    parser.add_argument("--timeout", type=float, default=900)
+    parser.add_argument("--stall", type=float, default=10, help="give up on a scenario after this long without API traffic")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="filestore-load-"))
+    os.environ.update(BOT_TOKEN="123:load", BIN_CHANNEL="-100", OWNER_ID=str(ADMIN_BASE),
+                      WORKER_THREADS=str(args.threads), METRICS="1", MEDIA_GROUP_WINDOW="0.3",
+                      BROADCAST_RATE=os.environ.get("BROADCAST_RATE", "100000"),
+                      API_GLOBAL_RATE=os.environ.get("API_GLOBAL_RATE", "0"))
+
+    api = StubBotAPI(latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+                     retry_after=args.retry_after).start()
+    api.install()
+    import main as app
+    app.updates.attach()  # lane dispatcher, as in production polling mode
+
+    poller = threading.Thread(target=app.bot.polling,
+                              kwargs=dict(non_stop=True, interval=0, timeout=10, long_polling_timeout=1), daemon=True)
+    poller.start()
+
+    test = LoadTest(app, api, args)
+    try:
+        for name in args.scenarios.split(","):
+            print(f"▶ {name}...", flush=True)
+            getattr(test, name.strip())()
+    finally:
+        app.bot.stop_polling()
+        test.print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🧪 FAKE TELEGRAM BOT API (Offline Benchmarks)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+    api = StubBotAPI(latency=0.05, flood_rate=0.01).start()
+    api.install()      # points telebot (sync + async) at the stub
+    api.push_update({...})          # served through getUpdates
+    api.wait_for("copyMessage", 500)
+
+Implements getMe, getUpdates (long polling), sendMessage, copyMessage,
+forwardMessage(s), editMessageText and answers anything else with ``true``.
+Send-type calls can be made to fail with 429 + retry_after at ``flood_rate``,
+or to one chat on demand with ``throttle(chat_id, seconds)``.
+"""
+
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SEND_METHODS = {"sendMessage", "copyMessage", "forwardMessage", "forwardMessages", "sendMediaGroup",
+                "sendDocument", "sendPhoto", "sendVideo", "sendAudio", "editMessageText"}
+
+
+class StubBotAPI:
+    """Answers Bot API calls with plausible results after ``latency`` seconds."""
+
+    def __init__(self, latency=0.0, jitter=0.0, flood_rate=0.0, retry_after=1, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.floods = Counter()
+        self.last_call = {}  # (method, chat_id) -> perf_counter() of the latest answer
+        self.throttled = {}  # chat_id -> monotonic() until which its sends get 429
+        self._updates = deque()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body are separate writes: avoid delayed-ACK stalls
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                params = stub.parse_params(url.query, body, self.headers.get("Content-Type") or "")
+                code, payload = stub.handle(method, params)
+                raw = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    # --- plumbing ---
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="stub-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def install(self):
+        from telebot import apihelper
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        try:
+            from telebot import asyncio_helper
+            asyncio_helper.API_URL = apihelper.API_URL
+        except ImportError:  # aiohttp missing: sync runtime only
+            pass
+
+    def wait_for(self, method, count, timeout=300, stall=None):
+        """Blocks until ``method`` was answered ``count`` times.
+
+        With ``stall`` set, gives up once no API call at all has been answered
+        for that many seconds and returns the count reached instead of raising.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            seen, quiet_since = sum(self.calls.values()), time.monotonic()
+            while self.calls[method] < count:
+                now = time.monotonic()
+                total = sum(self.calls.values())
+                if total != seen:
+                    seen, quiet_since = total, now
+                if stall and now - quiet_since >= stall:
+                    break
+                if now >= deadline:
+                    raise TimeoutError(f"{method}: {self.calls[method]}/{count} calls")
+                self._cond.wait(min(deadline - now, stall or deadline - now))
+            return self.calls[method]
+
+    def throttle(self, chat_id, seconds):
+        """Answers every send to ``chat_id`` with 429 for the next ``seconds``."""
+        with self._lock:
+            self.throttled[int(chat_id)] = time.monotonic() + seconds
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.floods.clear()
+            self.last_call.clear()
+
+    @staticmethod
+    def parse_params(query, body, content_type):
+        params = {k: v[0] for k, v in parse_qs(query).items()}
+        if body and "json" in content_type:
+            params.update(json.loads(body))
+        elif body and "urlencoded" in content_type:
+            params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+        return params
+
+    # --- updates ---
+    def push_update(self, update):
+        """Queues an update dict (``update_id`` is assigned) for getUpdates."""
+        with self._cond:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update["update_id"]
+
+    def pending_updates(self):
+        with self._lock:
+            return len(self._updates)
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._cond:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return list(itertools.islice(self._updates, 0, limit))
+
+    # --- Bot API ---
+    def message(self, params):
+        chat_id = int(params.get("chat_id") or 0)
+        return {"message_id": next(self._ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+                "text": params.get("text", "")}
+
+    def handle(self, method, params):
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self.get_updates(params)}
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+
+        if method in SEND_METHODS:
+            wait = self.retry_after if self.flood_rate and random.random() < self.flood_rate else 0
+            until = self.throttled.get(int(params.get("chat_id") or 0), 0) - time.monotonic()
+            if until > 0:
+                wait = max(1, round(until))
+            if wait:
+                with self._cond:
+                    self.floods[method] += 1
+                return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {wait}",
+                             "parameters": {"retry_after": wait}}
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_filestore_bot"}
+        elif method == "copyMessage":
+            result = {"message_id": next(self._ids)}
+        elif method == "forwardMessages":
+            result = [{"message_id": next(self._ids)} for _ in json.loads(params.get("message_ids") or "[]")]
+        elif method == "sendMediaGroup":
+            result = [self.message(params) for _ in json.loads(params.get("media") or "[]")]
+        elif method in ("sendMessage", "forwardMessage", "editMessageText", "sendDocument",
+                        "sendPhoto", "sendVideo", "sendAudio"):
+            result = self.message(params)
+        else:
+            result = True
+
+        with self._cond:
+            self.calls[method] += 1
+            if "chat_id" in params:
+                self.last_call[(method, int(params["chat_id"]))] = time.perf_counter()
+            self._cond.notify_all()
+        return 200, {"ok": True, "result": result}
@@ -7,18 +7,35 @@
 
 import os
 import sys
+import asyncio
+import atexit
+import queue
 import time
 import logging
 import sqlite3
 import threading
+import inspect
+import json
+import re
+import contextvars
 import secrets
-import socket
+import signal
+import gzip
+import tempfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from functools import wraps
-from typing import Optional
+from functools import lru_cache, wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
 
+import requests
 import telebot
-from telebot import types
+from telebot import apihelper, types, util
+from requests.adapters import HTTPAdapter
+from telebot.apihelper import ApiTelegramException
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # ⚙️ CONFIGURATION
@@ -27,210 +44,1867 @@ from telebot import types
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 OWNER_ID = int(os.environ.get('OWNER_ID', '0'))
 BIN_CHANNEL = int(os.environ.get('BIN_CHANNEL', '0'))  # Storage Channel
+STORAGE_CHANNELS = [int(c) for c in os.environ.get('STORAGE_CHANNELS', '').replace(' ', '').split(',') if c]  # extra storage channels
+STORAGE_POLICY = os.environ.get('STORAGE_POLICY', 'round_robin')  # round_robin | least_throttled | hash
 LOG_CHANNEL = int(os.environ.get('LOG_CHANNEL', '0'))  # Log Channel
 
 # DB Config
-DB_NAME = "bot_data.db"
+DB_NAME = os.environ.get('DB_NAME', 'bot_data.db')
 ADMIN_LIST = [OWNER_ID] 
 
+# Concurrency
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', '8'))  # telebot handler threads
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', str(WORKER_THREADS + 4)))
+
+# Caches
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '50000'))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '300'))         # seconds
+SETTINGS_CACHE_TTL = int(os.environ.get('SETTINGS_CACHE_TTL', '60'))  # seconds
+FILE_CACHE_SIZE = int(os.environ.get('FILE_CACHE_SIZE', '20000'))
+FILE_CACHE_TTL = int(os.environ.get('FILE_CACHE_TTL', '3600'))        # seconds
+FILE_MISS_TTL = int(os.environ.get('FILE_MISS_TTL', '30'))            # unknown codes
+
+# UI
+FILES_PAGE_SIZE = int(os.environ.get('FILES_PAGE_SIZE', '8'))
+
+# Filename search (/search and inline mode; inline mode must be enabled in @BotFather)
+SEARCH_RESULTS = int(os.environ.get('SEARCH_RESULTS', '10'))
+INLINE_RESULTS = int(os.environ.get('INLINE_RESULTS', '20'))
+SEARCH_MIN_TERM = int(os.environ.get('SEARCH_MIN_TERM', '2'))  # shorter words are ignored (no 1-letter prefix scans)
+INLINE_CACHE_TIME = int(os.environ.get('INLINE_CACHE_TIME', '300'))  # seconds Telegram caches answers
+
+# Bundles: one link for many files, delivered as media groups
+BUNDLE_MAX_FILES = int(os.environ.get('BUNDLE_MAX_FILES', '100'))
+BUNDLE_GROUP_INTERVAL = float(os.environ.get('BUNDLE_GROUP_INTERVAL', '1.0'))  # seconds between groups to one chat
+BUNDLE_WORKERS = int(os.environ.get('BUNDLE_WORKERS', '4'))
+
+# Albums: wait this long after the last part of a media group before storing it
+MEDIA_GROUP_WINDOW = float(os.environ.get('MEDIA_GROUP_WINDOW', '1.0'))  # seconds
+
+# Broadcasts (Telegram allows ~30 msg/s globally)
+BROADCAST_WORKERS = int(os.environ.get('BROADCAST_WORKERS', '4'))
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '25'))              # messages / second
+BROADCAST_PROGRESS_INTERVAL = int(os.environ.get('BROADCAST_PROGRESS_INTERVAL', '5'))  # seconds
+
+# Download counter write-behind interval (max counts lost on a crash)
+DOWNLOAD_FLUSH_INTERVAL = int(os.environ.get('DOWNLOAD_FLUSH_INTERVAL', '10'))  # seconds
+
+# Instrumentation: /metrics on PORT (off = handlers and DB are not wrapped at all)
+METRICS_ENABLED = os.environ.get('METRICS', '0') == '1'
+
+# Runtime: "threads" (TeleBot worker pool) or "async" (AsyncTeleBot, needs aiohttp)
+RUNTIME = os.environ.get('RUNTIME', 'threads').lower()
+ASYNC_MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', '1000'))  # updates in flight before getUpdates stops confirming
+ASYNC_HTTP_LIMIT = int(os.environ.get('ASYNC_HTTP_LIMIT', '100'))       # pooled connections
+
+# Log channel batching
+LOG_FLUSH_INTERVAL = int(os.environ.get('LOG_FLUSH_INTERVAL', '3'))  # seconds
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '1000'))
+
+# Update ingestion: webhook when WEBHOOK_URL is set (falls back to polling)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')            # public base URL, e.g. https://app.onrender.com
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBHOOK_MAX_BODY = int(os.environ.get('WEBHOOK_MAX_BODY', str(1 << 20)))  # bytes; larger POSTs get 413
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', '1000'))  # per dispatch lane
+RUN_MODE = "polling"
+STARTED_AT = time.time()
+
+# Background recount of the stats counters
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', '21600'))  # seconds
+
+# Update dispatch lanes: weighted fair share of the workers, and per-lane worker caps
+DISPATCH_WEIGHTS = {k: int(v) for k, v in (p.split(':') for p in os.environ.get(
+    'DISPATCH_WEIGHTS', 'delivery:8,interactive:4,upload:2,background:1').split(','))}
+DISPATCH_MAX_WORKERS = {k: int(v) for k, v in (p.split(':') for p in os.environ.get(
+    'DISPATCH_MAX_WORKERS', f'upload:{max(1, WORKER_THREADS // 2)},background:{max(1, WORKER_THREADS // 4)}').split(','))}
+SHUTDOWN_GRACE = float(os.environ.get('SHUTDOWN_GRACE', '20'))  # seconds queued updates get on SIGTERM (Render allows 30)
+BROADCAST_YIELD_WAIT = float(os.environ.get('BROADCAST_YIELD_WAIT', '0.5'))  # max pause per send while users wait
+
+# Snapshots for ephemeral disks: '' (off), 'local' (SNAPSHOT_DIR) or 'telegram' (SNAPSHOT_CHANNEL)
+SNAPSHOT_STORE = os.environ.get('SNAPSHOT_STORE', '').lower()
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_CHANNEL = int(os.environ.get('SNAPSHOT_CHANNEL', '0')) or BIN_CHANNEL
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', '900'))  # seconds
+SNAPSHOT_KEEP = int(os.environ.get('SNAPSHOT_KEEP', '3'))
+JOURNAL_FLUSH_INTERVAL = int(os.environ.get('JOURNAL_FLUSH_INTERVAL', '30'))  # max seconds of writes lost
+
+# Per-user flood control: tokens / second and burst per lane (rate 0 = lane off)
+FLOOD_DEEPLINK_RATE = float(os.environ.get('FLOOD_DEEPLINK_RATE', '0.5'))  # /start <code> and other commands
+FLOOD_DEEPLINK_BURST = int(os.environ.get('FLOOD_DEEPLINK_BURST', '10'))
+FLOOD_UPLOAD_RATE = float(os.environ.get('FLOOD_UPLOAD_RATE', '0.5'))      # a whole album costs one token
+FLOOD_UPLOAD_BURST = int(os.environ.get('FLOOD_UPLOAD_BURST', '10'))
+FLOOD_CALLBACK_RATE = float(os.environ.get('FLOOD_CALLBACK_RATE', '2'))
+FLOOD_CALLBACK_BURST = int(os.environ.get('FLOOD_CALLBACK_BURST', '15'))
+FLOOD_STRIKES = int(os.environ.get('FLOOD_STRIKES', '20'))       # rejections within FLOOD_COOLDOWN...
+FLOOD_COOLDOWN = int(os.environ.get('FLOOD_COOLDOWN', '300'))    # ...mute the user for this many seconds
+FLOOD_SWEEP_INTERVAL = int(os.environ.get('FLOOD_SWEEP_INTERVAL', '60'))  # seconds
+
+# Outbound Bot API scheduler (messages / second; 0 = unlimited, 429s are still waited out)
+API_GLOBAL_RATE = float(os.environ.get('API_GLOBAL_RATE', '30'))   # all chats together
+API_CHAT_RATE = float(os.environ.get('API_CHAT_RATE', '1'))        # per private chat...
+API_CHAT_BURST = int(os.environ.get('API_CHAT_BURST', str(max(5, FLOOD_DEEPLINK_BURST, FLOOD_UPLOAD_BURST, FLOOD_CALLBACK_BURST))))
+API_CHAT_MAX_WAIT = float(os.environ.get('API_CHAT_MAX_WAIT', '1'))  # longer chat pacing -> send now, don't hold the worker
+API_GROUP_RATE = float(os.environ.get('API_GROUP_RATE', '0'))      # per group/channel (storage channels too)
+API_GROUP_BURST = int(os.environ.get('API_GROUP_BURST', '20'))
+API_MAX_RETRY_WAIT = int(os.environ.get('API_MAX_RETRY_WAIT', '30'))  # longer retry_after -> fail instead of waiting
+API_MAX_RETRIES = int(os.environ.get('API_MAX_RETRIES', '3'))
+API_POOL_SIZE = int(os.environ.get('API_POOL_SIZE', str(WORKER_THREADS + BROADCAST_WORKERS + 8)))  # keep-alive connections
+
 # Initialize Bot
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="Markdown")
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode="Markdown", num_threads=WORKER_THREADS)
 logger = telebot.logger
 telebot.logger.setLevel(logging.INFO)
 
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 📡 METRICS (Prometheus text format, METRICS=1)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class Metrics:
+    """Minimal thread-safe registry rendered in Prometheus text format."""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf, sum]
+        self._gauges = {}      # name -> fn() -> [(labels, value)]
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound: h[i] += 1
+            h[-2] += 1
+            h[-1] += seconds
+
+    def gauge(self, name, fn, text="", kind="gauge"):
+        """Registers a series computed at scrape time; ``fn`` returns [(labels, value)]."""
+        self._gauges[name] = fn
+        self.describe(name, kind, text)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs: return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+        lines, seen = [], set()
+
+        def header(name):
+            if name in seen: return
+            seen.add(name)
+            kind, text = self._help.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name)
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in sorted(histograms.items()):
+            header(name)
+            for bound, n in zip(self.BUCKETS, h):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {n}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {h[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {h[-2]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h[-1]:.6f}")
+        for name, fn in sorted(self._gauges.items()):
+            try: samples = fn()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {e}")
+                continue
+            header(name)
+            for labels, value in samples:
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("filestore_handler_seconds", "histogram", "Handler latency")
+metrics.describe("filestore_handler_errors_total", "counter", "Handler exceptions")
+metrics.describe("filestore_db_seconds", "histogram", "Database method latency")
+metrics.describe("filestore_db_errors_total", "counter", "Database method exceptions")
+metrics.describe("filestore_api_seconds", "histogram", "Telegram Bot API call latency")
+metrics.describe("filestore_api_errors_total", "counter", "Telegram Bot API errors by code")
+metrics.describe("filestore_api_429_total", "counter", "Telegram Bot API flood-wait (429) responses")
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def _track(name, delta):
+    with _in_flight_lock:
+        _in_flight[name] += delta
+
+def timed(name, family="handler"):
+    """Records latency/errors (and in-flight count for handlers) of ``func``.
+
+    Returns ``func`` untouched when metrics are off, so the hot path pays nothing.
+    """
+    def decorator(func):
+        if not METRICS_ENABLED: return func
+        labels = (("handler" if family == "handler" else "method", name),)
+        seconds, errors = f"filestore_{family}_seconds", f"filestore_{family}_errors_total"
+        track = family == "handler"
+        if track: _in_flight.setdefault(name, 0)
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if track: _track(name, 1)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    metrics.inc(errors, labels)
+                    raise
+                finally:
+                    metrics.observe(seconds, labels, time.perf_counter() - start)
+                    if track: _track(name, -1)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if track: _track(name, 1)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metrics.inc(errors, labels)
+                raise
+            finally:
+                metrics.observe(seconds, labels, time.perf_counter() - start)
+                if track: _track(name, -1)
+        return wrapper
+    return decorator
+
+metrics.gauge("filestore_handlers_in_flight", lambda: [((("handler", k),), v) for k, v in sorted(_in_flight.items())],
+              "Handlers currently running")
+
+def _observe_api(method_name, start, error):
+    labels = (("method", method_name),)
+    metrics.observe("filestore_api_seconds", labels, time.perf_counter() - start)
+    if isinstance(error, ApiTelegramException):
+        metrics.inc("filestore_api_errors_total", labels + (("code", error.error_code),))
+        if error.error_code == 429: metrics.inc("filestore_api_429_total", labels)
+    elif error is not None:
+        metrics.inc("filestore_api_errors_total", labels + (("code", "network"),))
+
+def instrument_api():
+    """Times every Bot API call made through telebot's request function."""
+    make_request = apihelper._make_request
+
+    def timed_request(token, method_name, *args, **kwargs):
+        start, error = time.perf_counter(), None
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _observe_api(method_name, start, error)
+    apihelper._make_request = timed_request
+
+def instrument_methods(obj, family, skip=()):
+    """Wraps the public, non-generator methods of ``obj`` with ``timed``."""
+    for name in dir(type(obj)):
+        attr = getattr(type(obj), name)
+        if name.startswith('_') or name in skip or not callable(attr) or isinstance(attr, (type, staticmethod)):
+            continue
+        if inspect.isgeneratorfunction(attr) or isinstance(inspect.getattr_static(type(obj), name), staticmethod):
+            continue
+        setattr(obj, name, timed(name, family)(getattr(obj, name)))
+
+if METRICS_ENABLED:
+    instrument_api()
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 🗄️ DATABASE ENGINE (SQLite)
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
+_MISS = object()  # cache sentinel (None is a valid cached value)
+
+
+class ConnectionPool:
+    """Reusable SQLite connections shared by the handler threads.
+
+    A thread borrows one connection for the length of a ``with`` block. Nested
+    borrows on the same thread get the same connection back, so a transaction
+    can span several Database helpers without deadlocking the pool.
+    """
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",        # readers never block the writer
+        "PRAGMA synchronous=NORMAL",      # fsync on checkpoint only (safe with WAL)
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA cache_size=-16000",       # ~16MB page cache per connection
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=134217728",
+    )
+
+    def __init__(self, db_file, size=8):
+        self.db_file = db_file
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        self.journal = None     # ChangeJournal once attached (see attach_journal)
+        self.waits = 0          # borrows that found every connection busy
+        self.wait_seconds = 0.0
+
+    def _connect(self):
+        # isolation_level=None -> autocommit; transactions are explicit (see Database.transaction)
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None,
+                               timeout=5, cached_statements=256, factory=JournalConnection)
+        conn.journal = self.journal
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - start
+        try:
+            try: conn = self._idle.get_nowait()
+            except queue.Empty: conn = self._connect()
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                if conn.in_transaction: conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def attach_journal(self, journal):
+        """Starts journaling writes on every connection, current and future."""
+        with self._lock:
+            self.journal = journal
+            for conn in self._all:
+                conn.journal = journal
+
+    def close_all(self):
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try: conn.close()
+            except sqlite3.Error: pass
+
+
+class TTLCache:
+    """Bounded LRU map whose entries also expire after ``ttl`` seconds.
+
+    ``generation`` is bumped on every invalidation; readers that load from the
+    DB pass the value they saw to ``set`` so a concurrent write can't be
+    overwritten by the stale row they just read.
+    """
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] < time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl=None, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class FileRecord(NamedTuple):
+    """What a deep link needs to deliver a file."""
+    channel_id: int
+    message_id: int
+    name: str
+
+
+def sql_now():
+    """UTC time in SQLite's CURRENT_TIMESTAMP format, bound as a parameter so journal replay keeps it."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
 class Database:
-    def __init__(self, db_file):
+    def __init__(self, db_file, pool_size=8):
         self.db_file = db_file
+        self.pool = ConnectionPool(db_file, pool_size)
+        # Hot-path caches: check_user reads both on every update
+        self.user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)      # uid -> (role, banned, known, blocked)
+        self.settings_cache = TTLCache(256, SETTINGS_CACHE_TTL)          # key -> value | None
+        self.file_cache = TTLCache(FILE_CACHE_SIZE, FILE_CACHE_TTL)      # code -> FileRecord | None (miss)
         self.init_db()
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_file, check_same_thread=False)
+    def connection(self):
+        return self.pool.connection()
+
+    @contextmanager
+    def transaction(self):
+        """Atomic block; nested calls join the outer transaction."""
+        with self.pool.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def fetchone(self, sql, params=()):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        """Single write statement (autocommit unless inside a transaction)."""
+        with self.pool.connection() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def close(self):
+        self.pool.close_all()
+
+    def caches(self):
+        return (("user", self.user_cache), ("settings", self.settings_cache), ("file", self.file_cache))
+
+    # Schema migrations, applied in order and tracked with PRAGMA user_version.
+    # Each entry is a tuple of SQL strings and/or callables taking the connection.
+    MIGRATIONS = (
+        # 1: broadcast delivery state
+        ("ALTER TABLE users ADD COLUMN blocked INTEGER DEFAULT 0",),
+        # 2: upload dedup -- index stored copies and repoint existing duplicates at the first one
+        ("CREATE INDEX IF NOT EXISTS idx_files_unique ON files (file_unique_id, channel_id)",
+         '''UPDATE files SET message_id = (
+                SELECT f.message_id FROM files f
+                WHERE f.file_unique_id = files.file_unique_id AND f.channel_id = files.channel_id
+                ORDER BY f.rowid LIMIT 1)
+            WHERE file_unique_id IS NOT NULL'''),
+        # 3: per-user file browser (keyset pagination) and time-ordered scans
+        ("CREATE INDEX IF NOT EXISTS idx_files_uploader ON files (uploader_id, created_at, file_code)",
+         "CREATE INDEX IF NOT EXISTS idx_files_created ON files (created_at)"),
+        # 4: O(1) statistics -- counters kept by triggers in the writing transaction
+        #    Uploads count on the row's own created_at day, which journal replay preserves.
+        ("CREATE TABLE IF NOT EXISTS stats_counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)",
+         "CREATE TABLE IF NOT EXISTS stats_daily (day TEXT PRIMARY KEY, uploads INTEGER DEFAULT 0, downloads INTEGER DEFAULT 0)",
+         "CREATE TABLE IF NOT EXISTS channel_usage (channel_id INTEGER PRIMARY KEY, files INTEGER DEFAULT 0)",
+         '''CREATE TRIGGER IF NOT EXISTS trg_users_ins AFTER INSERT ON users BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE key = 'users';
+                UPDATE stats_counters SET value = value + NEW.banned WHERE key = 'banned';
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_users_ban AFTER UPDATE OF banned ON users BEGIN
+                UPDATE stats_counters SET value = value + NEW.banned - OLD.banned WHERE key = 'banned';
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_users_del AFTER DELETE ON users BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE key = 'users';
+                UPDATE stats_counters SET value = value - OLD.banned WHERE key = 'banned';
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_files_ins AFTER INSERT ON files BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE key = 'files';
+                INSERT INTO channel_usage (channel_id, files) VALUES (NEW.channel_id, 1)
+                    ON CONFLICT(channel_id) DO UPDATE SET files = files + 1;
+                INSERT INTO stats_daily (day, uploads) VALUES (date(NEW.created_at), 1)
+                    ON CONFLICT(day) DO UPDATE SET uploads = uploads + 1;
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_files_del AFTER DELETE ON files BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE key = 'files';
+                UPDATE channel_usage SET files = files - 1 WHERE channel_id = OLD.channel_id;
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_files_move AFTER UPDATE OF channel_id ON files BEGIN
+                UPDATE channel_usage SET files = files - 1 WHERE channel_id = OLD.channel_id;
+                INSERT INTO channel_usage (channel_id, files) VALUES (NEW.channel_id, 1)
+                    ON CONFLICT(channel_id) DO UPDATE SET files = files + 1;
+            END''',
+         lambda conn: Database.reconcile_stats(conn)),
+        # 5: change journal position (seq of the last journaled transaction in this file)
+        ("CREATE TABLE IF NOT EXISTS journal_state (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL)",
+         "INSERT OR IGNORE INTO journal_state (id, seq) VALUES (1, 0)"),
+        # 6: filename search -- FTS5 index over files.file_name kept in sync by triggers,
+        #    plus the message kind so inline results can reuse the stored file_id. Older rows
+        #    stay 'document': a name like photo.jpg doesn't prove the file_id is a photo.
+        #    uploader_id is indexed too: each MATCH ANDs in the searcher's id, so bm25 only
+        #    ranks their rows. 2/3-letter prefixes read one prefix-index doclist; longer
+        #    prefixes still merge every matching term's doclist across all users.
+        ("ALTER TABLE files ADD COLUMN media_kind TEXT DEFAULT 'document'",
+         '''CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                file_name, uploader_id, content='files', content_rowid='rowid',
+                prefix='2 3', tokenize='unicode61 remove_diacritics 2')''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_files_fts_ins AFTER INSERT ON files BEGIN
+                INSERT INTO files_fts (rowid, file_name, uploader_id) VALUES (NEW.rowid, NEW.file_name, NEW.uploader_id);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_files_fts_del AFTER DELETE ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, file_name, uploader_id)
+                    VALUES ('delete', OLD.rowid, OLD.file_name, OLD.uploader_id);
+            END''',
+         '''CREATE TRIGGER IF NOT EXISTS trg_files_fts_upd AFTER UPDATE OF file_name, uploader_id ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, file_name, uploader_id)
+                    VALUES ('delete', OLD.rowid, OLD.file_name, OLD.uploader_id);
+                INSERT INTO files_fts (rowid, file_name, uploader_id) VALUES (NEW.rowid, NEW.file_name, NEW.uploader_id);
+            END''',
+         "INSERT INTO files_fts (files_fts) VALUES ('rebuild')"),
+        # 7: bundles -- one code for an ordered list of file codes
+        ("""CREATE TABLE IF NOT EXISTS bundles (
+                bundle_code TEXT PRIMARY KEY,
+                owner_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
+         """CREATE TABLE IF NOT EXISTS bundle_items (
+                bundle_code TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                file_code TEXT NOT NULL,
+                PRIMARY KEY (bundle_code, position)) WITHOUT ROWID"""),
+    )
+
+    def migrate(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, steps in enumerate(self.MIGRATIONS[version:], version + 1):
+            for step in steps:
+                step(conn) if callable(step) else conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {number}')
+            logger.info(f"DB migrated to schema v{number}")
 
     def init_db(self):
-        conn = self.get_connection()
-        c = conn.cursor()
-        
-        # Users
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            role TEXT DEFAULT 'user',
-            banned INTEGER DEFAULT 0,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        
-        # Files
-        c.execute('''CREATE TABLE IF NOT EXISTS files (
-            file_code TEXT PRIMARY KEY,
-            file_name TEXT,
-            mime_type TEXT,
-            file_id TEXT,
-            file_unique_id TEXT,
-            message_id INTEGER,
-            channel_id INTEGER,
-            uploader_id INTEGER,
-            downloads INTEGER DEFAULT 0,
-            visibility TEXT DEFAULT 'public',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        # Channels mapping
-        c.execute('''CREATE TABLE IF NOT EXISTS channels (
-            user_id INTEGER PRIMARY KEY,
-            channel_id INTEGER,
-            channel_title TEXT
-        )''')
-
-        # Settings (Key-Value)
-        c.execute('''CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )''')
-
-        conn.commit()
-        conn.close()
+        with self.transaction() as c:
+            # Users
+            c.execute('''CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                role TEXT DEFAULT 'user',
+                banned INTEGER DEFAULT 0,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+
+            # Files
+            c.execute('''CREATE TABLE IF NOT EXISTS files (
+                file_code TEXT PRIMARY KEY,
+                file_name TEXT,
+                mime_type TEXT,
+                file_id TEXT,
+                file_unique_id TEXT,
+                message_id INTEGER,
+                channel_id INTEGER,
+                uploader_id INTEGER,
+                downloads INTEGER DEFAULT 0,
+                visibility TEXT DEFAULT 'public',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+
+            # Channels mapping
+            c.execute('''CREATE TABLE IF NOT EXISTS channels (
+                user_id INTEGER PRIMARY KEY,
+                channel_id INTEGER,
+                channel_title TEXT
+            )''')
+
+            # Settings (Key-Value)
+            c.execute('''CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )''')
+
+            # Download rollups (period = 'hour' | 'day', bucket = UTC time prefix)
+            c.execute('''CREATE TABLE IF NOT EXISTS download_stats (
+                period TEXT,
+                bucket TEXT,
+                file_code TEXT,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (period, bucket, file_code)
+            )''')
+
+            # Broadcast jobs (cursor = last user_id fully processed)
+            c.execute('''CREATE TABLE IF NOT EXISTS broadcasts (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_id INTEGER,
+                from_chat INTEGER,
+                message_id INTEGER,
+                status_chat INTEGER,
+                status_msg INTEGER,
+                cursor INTEGER DEFAULT -9223372036854775808,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                state TEXT DEFAULT 'running',
+                started_at REAL,
+                finished_at REAL
+            )''')
+
+            self.migrate(c)
 
     # --- SETTINGS ---
     def get_setting(self, key, default="0"):
-        conn = self.get_connection()
-        res = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
-        conn.close()
-        return res[0] if res else default
+        value = self.settings_cache.get(key, _MISS)
+        if value is _MISS:
+            gen = self.settings_cache.generation
+            res = self.fetchone('SELECT value FROM settings WHERE key = ?', (key,))
+            value = res[0] if res else None
+            self.settings_cache.set(key, value, generation=gen)
+        return default if value is None else value
 
     def set_setting(self, key, value):
-        conn = self.get_connection()
-        conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value)))
-        conn.commit()
-        conn.close()
+        self.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value)))
+        self.settings_cache.pop(key)
 
     # --- USERS ---
+    def _user_row(self, user_id):
+        """(role, banned, known, blocked) for a user, served from the cache."""
+        row = self.user_cache.get(user_id)
+        if row is None:
+            gen = self.user_cache.generation
+            res = self.fetchone('SELECT role, banned, blocked FROM users WHERE user_id = ?', (user_id,))
+            row = (res[0], res[1], True, res[2]) if res else ('user', 0, False, 0)
+            self.user_cache.set(user_id, row, generation=gen)
+        return row
+
     def add_user(self, user_id):
-        conn = self.get_connection()
-        conn.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
-        conn.commit()
-        conn.close()
+        _, _, known, blocked = self._user_row(user_id)
+        if known and not blocked: return  # already registered
+        if blocked:  # they are talking to us again, so broadcasts can reach them
+            self.execute('UPDATE users SET blocked = 0 WHERE user_id = ?', (user_id,))
+        else:
+            self.execute('INSERT OR IGNORE INTO users (user_id, joined_at) VALUES (?, ?)', (user_id, sql_now()))
+        self.user_cache.pop(user_id)
 
     def get_user_status(self, user_id):
-        conn = self.get_connection()
-        res = conn.execute('SELECT role, banned FROM users WHERE user_id = ?', (user_id,)).fetchone()
-        conn.close()
-        return res if res else ('user', 0)
+        role, banned, _, _ = self._user_row(user_id)
+        return role, banned
 
     def set_ban(self, user_id, is_banned):
-        conn = self.get_connection()
-        conn.execute('UPDATE users SET banned = ? WHERE user_id = ?', (1 if is_banned else 0, user_id))
-        conn.commit()
-        conn.close()
-
-    def get_all_users(self):
-        """Yields users for broadcast to save RAM"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users')
+        self.execute('UPDATE users SET banned = ? WHERE user_id = ?', (1 if is_banned else 0, user_id))
+        self.user_cache.pop(user_id)
+
+    def get_all_users(self, batch=500):
+        """Yields users for broadcast to save RAM.
+
+        Pages by primary key so no read snapshot (or pooled connection) is
+        held open while the caller is busy sending.
+        """
+        last = -2**63
         while True:
-            rows = cursor.fetchmany(100)
+            rows = self.fetchall('SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (last, batch))
             if not rows: break
             for row in rows: yield row[0]
-        conn.close()
+            last = rows[-1][0]
+
+    def mark_blocked(self, user_ids):
+        with self.transaction() as conn:
+            conn.executemany('UPDATE users SET blocked = 1 WHERE user_id = ?', [(u,) for u in user_ids])
+        for uid in user_ids: self.user_cache.pop(uid)
+
+    # --- BROADCASTS ---
+    def create_broadcast(self, admin_id, from_chat, message_id, status_chat, status_msg):
+        with self.connection() as conn:
+            return conn.execute('''INSERT INTO broadcasts (admin_id, from_chat, message_id, status_chat, status_msg, started_at)
+                                   VALUES (?,?,?,?,?,?)''', (admin_id, from_chat, message_id, status_chat, status_msg, time.time())).lastrowid
+
+    def get_broadcast(self, job_id):
+        return self.fetchone('''SELECT job_id, admin_id, from_chat, message_id, status_chat, status_msg,
+                                 cursor, sent, failed, blocked, state, started_at FROM broadcasts WHERE job_id = ?''', (job_id,))
+
+    def get_running_broadcasts(self):
+        return [r[0] for r in self.fetchall("SELECT job_id FROM broadcasts WHERE state = 'running'")]
+
+    def get_broadcast_targets(self, after, limit):
+        return [r[0] for r in self.fetchall(
+            'SELECT user_id FROM users WHERE user_id > ? AND blocked = 0 ORDER BY user_id LIMIT ?', (after, limit))]
+
+    def save_broadcast_progress(self, job_id, cursor, sent, failed, blocked, state='running'):
+        self.execute('''UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ?, state = ?,
+                        finished_at = CASE WHEN ? = 'running' THEN NULL ELSE ? END WHERE job_id = ?''',
+                     (cursor, sent, failed, blocked, state, state, time.time(), job_id))
 
     # --- FILES ---
-    def add_file(self, code, name, mime, fid, uid, mid, cid, uploader):
-        conn = self.get_connection()
-        conn.execute('''INSERT INTO files (file_code, file_name, mime_type, file_id, file_unique_id, 
-                        message_id, channel_id, uploader_id) VALUES (?,?,?,?,?,?,?,?)''',
-                        (code, name, mime, fid, uid, mid, cid, uploader))
-        conn.commit()
-        conn.close()
+    def add_file(self, code, name, mime, fid, uid, mid, cid, uploader, kind='document'):
+        self.add_files([(code, name, mime, fid, uid, mid, cid, uploader, kind)])
+
+    def add_files(self, rows):
+        """Inserts many add_file() tuples in one transaction (``kind`` may be left off)."""
+        now = sql_now()
+        rows = [(*row, now) if len(row) == 9 else (*row, 'document', now) for row in rows]
+        with self.transaction() as conn:
+            conn.executemany('''INSERT INTO files (file_code, file_name, mime_type, file_id, file_unique_id,
+                                message_id, channel_id, uploader_id, media_kind, created_at)
+                                VALUES (?,?,?,?,?,?,?,?,?,?)''', rows)
+        for row in rows: self.file_cache.pop(row[0])  # drop cached misses
+
+    def find_stored_copy(self, unique_id, channels, uploader):
+        """An existing copy of ``unique_id`` in any of ``channels``, preferring the uploader's own row.
+
+        Returns (file_code, message_id, uploader_id, channel_id) or None.
+        """
+        marks = ",".join("?" * len(channels))
+        return self.fetchone(f'''SELECT file_code, message_id, uploader_id, channel_id FROM files
+                                 WHERE file_unique_id = ? AND channel_id IN ({marks})
+                                 ORDER BY uploader_id = ? DESC LIMIT 1''', (unique_id, *channels, uploader))
 
     def get_file(self, code):
-        conn = self.get_connection()
-        res = conn.execute('SELECT * FROM files WHERE file_code = ?', (code,)).fetchone()
-        conn.close()
-        return res
+        return self.fetchone('SELECT * FROM files WHERE file_code = ?', (code,))
+
+    def resolve_file(self, code):
+        """FileRecord for a deep-link code or None; hits and misses are both cached."""
+        rec = self.file_cache.get(code, _MISS)
+        if rec is _MISS:
+            gen = self.file_cache.generation
+            res = self.fetchone('SELECT channel_id, message_id, file_name FROM files WHERE file_code = ?', (code,))
+            rec = FileRecord(*res) if res else None
+            self.file_cache.set(code, rec, ttl=None if rec else FILE_MISS_TTL, generation=gen)
+        return rec
 
     def delete_file(self, code):
-        conn = self.get_connection()
-        conn.execute('DELETE FROM files WHERE file_code = ?', (code,))
-        conn.commit()
-        conn.close()
+        self.execute('DELETE FROM files WHERE file_code = ?', (code,))
+        self.file_cache.pop(code)
+
+    def add_downloads(self, hits):
+        """Applies a batch of {(code, 'YYYY-MM-DD HH'): n} in one transaction."""
+        per_file, hourly, daily = {}, {}, {}
+        for (code, hour), n in hits.items():
+            per_file[code] = per_file.get(code, 0) + n
+            hourly[(hour, code)] = hourly.get((hour, code), 0) + n
+            daily[(hour[:10], code)] = daily.get((hour[:10], code), 0) + n
+
+        upsert = '''INSERT INTO download_stats (period, bucket, file_code, count) VALUES (?,?,?,?)
+                    ON CONFLICT(period, bucket, file_code) DO UPDATE SET count = count + excluded.count'''
+        with self.transaction() as conn:
+            conn.executemany('UPDATE files SET downloads = downloads + ? WHERE file_code = ?',
+                             [(n, code) for code, n in per_file.items()])
+            conn.executemany(upsert, [('hour', b, code, n) for (b, code), n in hourly.items()])
+            conn.executemany(upsert, [('day', b, code, n) for (b, code), n in daily.items()])
+            totals = {}
+            for (day, _), n in daily.items(): totals[day] = totals.get(day, 0) + n
+            conn.executemany('''INSERT INTO stats_daily (day, downloads) VALUES (?, ?)
+                                ON CONFLICT(day) DO UPDATE SET downloads = downloads + excluded.downloads''',
+                             list(totals.items()))
 
-    def add_download(self, code):
-        conn = self.get_connection()
-        conn.execute('UPDATE files SET downloads = downloads + 1 WHERE file_code = ?', (code,))
-        conn.commit()
-        conn.close()
+    def get_top_files(self, day, limit=10):
+        return self.fetchall('''SELECT s.file_code, f.file_name, s.count FROM download_stats s
+                                LEFT JOIN files f ON f.file_code = s.file_code
+                                WHERE s.period = 'day' AND s.bucket = ?
+                                ORDER BY s.count DESC LIMIT ?''', (day, limit))
+
+    def get_hourly_downloads(self, since_hour):
+        return self.fetchall('''SELECT bucket, SUM(count) FROM download_stats
+                                WHERE period = 'hour' AND bucket >= ?
+                                GROUP BY bucket ORDER BY bucket''', (since_hour,))
 
     def get_user_files_stats(self, user_id):
-        conn = self.get_connection()
-        count = conn.execute('SELECT COUNT(*) FROM files WHERE uploader_id = ?', (user_id,)).fetchone()[0]
-        conn.close()
-        return count
+        return self.fetchone('SELECT COUNT(*) FROM files WHERE uploader_id = ?', (user_id,))[0]
+
+    def get_user_files_page(self, user_id, limit, after=None, before=None):
+        """Newest-first page of (created_at, file_code, file_name) seeking on idx_files_uploader.
+
+        ``after``/``before`` are (created_at, file_code) keys of the last/first
+        row already shown. Returns (rows, has_more) where has_more refers to
+        the direction being paged in.
+        """
+        if before:
+            rows = self.fetchall('''SELECT created_at, file_code, file_name FROM files
+                                    WHERE uploader_id = ? AND (created_at, file_code) > (?, ?)
+                                    ORDER BY created_at, file_code LIMIT ?''', (user_id, *before, limit + 1))
+            return rows[:limit][::-1], len(rows) > limit
+        if after:
+            rows = self.fetchall('''SELECT created_at, file_code, file_name FROM files
+                                    WHERE uploader_id = ? AND (created_at, file_code) < (?, ?)
+                                    ORDER BY created_at DESC, file_code DESC LIMIT ?''', (user_id, *after, limit + 1))
+        else:
+            rows = self.fetchall('''SELECT created_at, file_code, file_name FROM files
+                                    WHERE uploader_id = ?
+                                    ORDER BY created_at DESC, file_code DESC LIMIT ?''', (user_id, limit + 1))
+        return rows[:limit], len(rows) > limit
+
+    # --- BUNDLES ---
+    def create_bundle(self, code, owner, file_codes):
+        with self.transaction() as conn:
+            conn.execute('INSERT INTO bundles (bundle_code, owner_id, created_at) VALUES (?, ?, ?)', (code, owner, sql_now()))
+            conn.executemany('INSERT INTO bundle_items (bundle_code, position, file_code) VALUES (?,?,?)',
+                             [(code, i, fc) for i, fc in enumerate(file_codes)])
+        return code
+
+    def get_bundle(self, code):
+        """[(file_code, channel_id, message_id, file_name, file_id, media_kind)] in bundle order; deleted files drop out."""
+        return self.fetchall('''SELECT f.file_code, f.channel_id, f.message_id, f.file_name, f.file_id, f.media_kind
+                                FROM bundle_items i JOIN files f ON f.file_code = i.file_code
+                                WHERE i.bundle_code = ? ORDER BY i.position''', (code,))
+
+    def existing_codes(self, codes):
+        marks = ",".join("?" * len(codes))
+        return {r[0] for r in self.fetchall(f'SELECT file_code FROM files WHERE file_code IN ({marks})', codes)}
+
+    def search_files(self, user_id, text, limit=10):
+        """The user's own files matching every word of ``text`` as a prefix, best bm25 first.
+
+        Returns [(file_code, file_name, file_id, media_kind)]. Words shorter than
+        SEARCH_MIN_TERM are ignored; a query with none left gives the newest files.
+        """
+        terms = [t for t in re.findall(r"\w+", text.lower()) if len(t) >= SEARCH_MIN_TERM][:8]
+        if not terms:
+            return self.fetchall('''SELECT file_code, file_name, file_id, media_kind FROM files
+                                    WHERE uploader_id = ? ORDER BY created_at DESC, file_code DESC LIMIT ?''', (user_id, limit))
+        # the uploader_id phrase keeps other users' rows out of the matches and the bm25 ranking
+        query = f'uploader_id : "{int(user_id)}" ' + " ".join(f'file_name : "{t}"*' for t in terms)
+        return self.fetchall('''SELECT f.file_code, f.file_name, f.file_id, f.media_kind
+                                FROM files_fts JOIN files f ON f.rowid = files_fts.rowid
+                                WHERE files_fts MATCH ?
+                                ORDER BY bm25(files_fts, 1.0, 0.0), f.created_at DESC LIMIT ?''', (query, limit))
 
     # --- STATS ---
     def get_system_stats(self):
-        conn = self.get_connection()
-        users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        counters = dict(self.fetchall('SELECT key, value FROM stats_counters'))
+        return counters.get('users', 0), counters.get('files', 0), counters.get('banned', 0)
+
+    def get_daily_stats(self, day):
+        res = self.fetchone('SELECT uploads, downloads FROM stats_daily WHERE day = ?', (day,))
+        return res if res else (0, 0)
+
+    def get_channel_usage(self, limit=5):
+        return self.fetchall('SELECT channel_id, files FROM channel_usage WHERE files > 0 ORDER BY files DESC LIMIT ?', (limit,))
+
+    def get_db_size(self):
+        """Bytes on disk, including the WAL."""
+        return sum(os.path.getsize(p) for p in (self.db_file, self.db_file + '-wal') if os.path.exists(p))
+
+    @staticmethod
+    def reconcile_stats(conn):
+        """Recounts the trigger-maintained counters from the base tables."""
+        users, banned = conn.execute('SELECT COUNT(*), COALESCE(SUM(banned), 0) FROM users').fetchone()
         files = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
-        banned = conn.execute('SELECT COUNT(*) FROM users WHERE banned = 1').fetchone()[0]
-        conn.close()
-        return users, files, banned
-    
+        conn.executemany('INSERT OR REPLACE INTO stats_counters (key, value) VALUES (?, ?)',
+                         [('users', users), ('banned', banned), ('files', files)])
+        conn.execute('DELETE FROM channel_usage')
+        conn.execute('INSERT INTO channel_usage (channel_id, files) SELECT channel_id, COUNT(*) FROM files GROUP BY channel_id')
+
+    def reconcile(self):
+        with self.transaction() as conn:
+            self.reconcile_stats(conn)
+
     # --- CHANNELS ---
     def set_channel(self, uid, cid, title):
-        conn = self.get_connection()
-        conn.execute('INSERT OR REPLACE INTO channels VALUES (?,?,?)', (uid, cid, title))
-        conn.commit()
-        conn.close()
-    
+        self.execute('INSERT OR REPLACE INTO channels VALUES (?,?,?)', (uid, cid, title))
+
     def get_channel(self, uid):
-        conn = self.get_connection()
-        res = conn.execute('SELECT channel_id FROM channels WHERE user_id = ?', (uid,)).fetchone()
-        conn.close()
+        res = self.fetchone('SELECT channel_id FROM channels WHERE user_id = ?', (uid,))
         return res[0] if res else None
 
-db = Database(DB_NAME)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 💾 SNAPSHOTS & CHANGE JOURNAL (Cold Start Restore)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class JournalConnection(sqlite3.Connection):
+    """Connection that hands every committed write to the change journal.
+
+    Write statements are collected per transaction. On COMMIT the transaction
+    is given the next sequence number, which is also stored in journal_state
+    inside that same transaction, so a snapshot knows exactly which journal
+    entries it already contains. Autocommit writes get their own transaction.
+    """
+    WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.journal = None
+        self._pending = []
+
+    def execute(self, sql, params=()):
+        if self.journal is None:
+            return super().execute(sql, params)
+        return self._run(super().execute, sql, params, lambda: [params if isinstance(params, dict) else list(params)])
+
+    def executemany(self, sql, seq_of_params):
+        if self.journal is None:
+            return super().executemany(sql, seq_of_params)
+        rows = [p if isinstance(p, dict) else list(p) for p in seq_of_params]
+        return self._run(super().executemany, sql, rows, lambda: rows)
+
+    def _run(self, run, sql, params, rows):
+        verb = sql.lstrip()[:8].upper()
+        if verb.startswith(("COMMIT", "END")):
+            return self._commit(lambda: run(sql, params))
+        if verb.startswith("ROLLBACK"):
+            self._pending = []
+            return run(sql, params)
+        if not verb.startswith(self.WRITES):
+            return run(sql, params)
+        if self.in_transaction:
+            cur = run(sql, params)
+            self._pending.append((sql, rows()))
+            return cur
+        super().execute("BEGIN IMMEDIATE")
+        try:
+            cur = run(sql, params)
+            self._pending = [(sql, rows())]
+            self._commit(lambda: super(JournalConnection, self).execute("COMMIT"))
+        except BaseException:
+            self._pending = []
+            if self.in_transaction: super().execute("ROLLBACK")
+            raise
+        return cur
+
+    def _commit(self, commit):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return commit()
+        seq = self.journal.next_seq()  # we hold the write lock, so seq order == commit order
+        super().execute("UPDATE journal_state SET seq = ?", (seq,))
+        cur = commit()
+        self.journal.append(seq, pending)
+        return cur
+
+    def rollback(self):
+        self._pending = []
+        super().rollback()
+
+
+class ChangeJournal:
+    """Ships committed writes to the snapshot store every ``interval`` seconds.
+
+    A crash loses at most one interval of writes. Entries are gzipped JSON
+    lines ``[seq, [[sql, [params, ...]], ...]]`` replayed in seq order on restore.
+    """
+    def __init__(self, store, interval=30):
+        self.store = store
+        self.interval = interval
+        self.seq = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def next_seq(self):
+        with self._lock:
+            self.seq += 1
+            return self.seq
+
+    def append(self, seq, statements):
+        with self._lock:
+            self._buffer.append([seq, statements])
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch: return
+        batch.sort(key=lambda entry: entry[0])
+        data = gzip.compress("\n".join(json.dumps(entry) for entry in batch).encode())
+        try:
+            self.store.put_journal(batch[0][0], batch[-1][0], data)
+        except Exception as e:
+            logger.error(f"Journal upload failed, retrying next tick: {e}")
+            with self._lock:
+                self._buffer[:0] = batch
+
+    def recover(self, database):
+        """Replays journal entries newer than the database's own seq; returns how many."""
+        with database.transaction() as conn:
+            base = conn.execute("SELECT seq FROM journal_state").fetchone()[0]
+            entries = {}
+            for blob in self.store.journals_after(base):
+                for line in gzip.decompress(blob).decode().splitlines():
+                    seq, statements = json.loads(line)
+                    if seq > base: entries[seq] = statements
+            for seq in sorted(entries):
+                conn.execute("SAVEPOINT replay")
+                try:
+                    for sql, rows in entries[seq]:
+                        conn.executemany(sql, rows)
+                    conn.execute("RELEASE replay")
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO replay")
+                    conn.execute("RELEASE replay")
+                    logger.error(f"Journal entry {seq} skipped: {e}")
+            self.seq = max([base, *entries])
+            conn.execute("UPDATE journal_state SET seq = ?", (self.seq,))
+        return len(entries)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        threading.Thread(target=self._run, name="journal", daemon=True).start()
+
+
+class LocalSnapshotStore:
+    """Snapshots and journal chunks as files in one directory (e.g. a mounted disk)."""
+    def __init__(self, directory):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, name, data):
+        tmp = os.path.join(self.dir, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.dir, name))
+
+    def _list(self, prefix):
+        """[(numbers in the file name, path)] oldest first."""
+        out = []
+        for name in os.listdir(self.dir):
+            if name.startswith(prefix) and name.endswith(".gz"):
+                out.append((tuple(int(n) for n in name.split(".")[0].split("-")[1:]), os.path.join(self.dir, name)))
+        return sorted(out)
+
+    def put_snapshot(self, seq, data):
+        self._write(f"snapshot-{seq:012d}.db.gz", data)
+
+    def put_journal(self, first, last, data):
+        self._write(f"journal-{first:012d}-{last:012d}.jsonl.gz", data)
+
+    def latest(self):
+        snaps = self._list("snapshot-")
+        if not snaps: return None
+        (seq,), path = snaps[-1]
+        with open(path, "rb") as f:
+            return seq, f.read()
+
+    def journals_after(self, seq):
+        blobs = []
+        for (first, last), path in self._list("journal-"):
+            if last > seq:
+                with open(path, "rb") as f: blobs.append(f.read())
+        return blobs
+
+    def prune(self, keep):
+        snaps = self._list("snapshot-")
+        for _, path in snaps[:-keep]:
+            os.remove(path)
+        oldest = snaps[-keep:][0][0][0] if snaps else 0
+        for (first, last), path in self._list("journal-"):
+            if last <= oldest: os.remove(path)
+
+
+class TelegramSnapshotStore:
+    """Snapshots and journal chunks as documents in a channel (the BIN channel by default).
+
+    A pinned text message holds the JSON manifest of what to download. Bots
+    can only download files up to 20 MB, so snapshots are split into parts.
+    """
+    PART_SIZE = 19 * 1024 * 1024
+    HEADER = "🗄 filestore snapshots"
+    MANIFEST_LIMIT = 3800  # leave room under Telegram's 4096 characters
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.manifest = {"snapshots": [], "journals": []}  # [seq, [[msg_id, file_id], ...]] / [first, last, msg_id, file_id]
+        self.manifest_id = None
+        self.on_full = None  # called when the manifest needs a snapshot to shrink it
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded: return
+        pinned = bot.get_chat(self.channel).pinned_message
+        if pinned and pinned.text and pinned.text.startswith(self.HEADER):
+            self.manifest = json.loads(pinned.text.split("\n", 1)[1])
+            self.manifest_id = pinned.message_id
+        self._loaded = True
+
+    def _save(self):
+        text = self.HEADER + "\n" + json.dumps(self.manifest, separators=(",", ":"))
+        if self.manifest_id:
+            try:
+                bot.edit_message_text(text, self.channel, self.manifest_id, parse_mode="")
+            except ApiTelegramException as e:
+                if "not modified" not in e.description: raise
+        else:
+            self.manifest_id = bot.send_message(self.channel, text, parse_mode="").message_id
+            bot.pin_chat_message(self.channel, self.manifest_id, disable_notification=True)
+        if len(text) > self.MANIFEST_LIMIT and self.on_full:
+            self.on_full()
+
+    def _upload(self, data, name):
+        msg = bot.send_document(self.channel, data, visible_file_name=name, disable_notification=True)
+        return [msg.message_id, msg.document.file_id]
+
+    def _download(self, file_id):
+        return bot.download_file(bot.get_file(file_id).file_path)
+
+    def _delete(self, msg_ids):
+        for msg_id in msg_ids:
+            try: bot.delete_message(self.channel, msg_id)
+            except ApiTelegramException as e: logger.debug(f"Snapshot cleanup skipped: {e}")
+
+    def put_snapshot(self, seq, data):
+        parts = [self._upload(data[i:i + self.PART_SIZE], f"snapshot-{seq}.{n}.db.gz")
+                 for n, i in enumerate(range(0, len(data), self.PART_SIZE))]
+        with self._lock:
+            self._load()
+            self.manifest["snapshots"].append([seq, parts])
+            self._save()
+
+    def put_journal(self, first, last, data):
+        msg_id, file_id = self._upload(data, f"journal-{first}-{last}.jsonl.gz")
+        with self._lock:
+            self._load()
+            self.manifest["journals"].append([first, last, msg_id, file_id])
+            self._save()
+
+    def latest(self):
+        with self._lock:
+            self._load()
+            if not self.manifest["snapshots"]: return None
+            seq, parts = self.manifest["snapshots"][-1]
+        return seq, b"".join(self._download(file_id) for _, file_id in parts)
+
+    def journals_after(self, seq):
+        with self._lock:
+            self._load()
+            wanted = [file_id for first, last, _, file_id in self.manifest["journals"] if last > seq]
+        return [self._download(file_id) for file_id in wanted]
+
+    def prune(self, keep):
+        with self._lock:
+            self._load()
+            snaps = self.manifest["snapshots"]
+            dropped, self.manifest["snapshots"] = snaps[:-keep], snaps[-keep:]
+            oldest = self.manifest["snapshots"][0][0] if self.manifest["snapshots"] else 0
+            gone = [j for j in self.manifest["journals"] if j[1] <= oldest]
+            self.manifest["journals"] = [j for j in self.manifest["journals"] if j[1] > oldest]
+            self._save()
+        self._delete([msg_id for _, parts in dropped for msg_id, _ in parts] + [j[2] for j in gone])
+
+
+class Snapshotter:
+    """Takes compressed online backups of the live database on a schedule.
+
+    The backup API copies pages through a read transaction, so handlers keep
+    reading and writing (WAL) while a snapshot is taken.
+    """
+    def __init__(self, database, store, interval=900, keep=3):
+        self.db = database
+        self.store = store
+        self.interval = interval
+        self.keep = keep
+        self.last_seq = None
+        self.last_at = 0.0
+        self.due = threading.Event()  # set to snapshot ahead of schedule
+
+    def take(self):
+        fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(self.db.db_file)))
+        os.close(fd)
+        try:
+            dest = sqlite3.connect(tmp)
+            try:
+                with self.db.connection() as src:
+                    src.backup(dest)
+                seq = dest.execute("SELECT seq FROM journal_state").fetchone()[0]
+            finally:
+                dest.close()
+            with open(tmp, "rb") as f:
+                data = gzip.compress(f.read(), compresslevel=6)
+        finally:
+            os.remove(tmp)
+        self.store.put_snapshot(seq, data)
+        self.store.prune(self.keep)
+        self.last_seq, self.last_at = seq, time.time()
+        logger.info(f"Snapshot at seq {seq} saved ({len(data) // 1024} KB)")
+        return seq
+
+    def _run(self):
+        while True:
+            self.due.wait(self.interval)
+            self.due.clear()
+            try:
+                self.take()
+            except Exception as e:
+                logger.error(f"Snapshot failed: {e}")
+
+    def start(self, now=False):
+        if now: self.due.set()
+        threading.Thread(target=self._run, name="snapshots", daemon=True).start()
+
+
+def restore_snapshot(db_file, store):
+    """Cold start: writes the newest snapshot to ``db_file`` if it doesn't exist yet."""
+    if os.path.exists(db_file): return False
+    try:
+        latest = store.latest()
+    except Exception as e:
+        logger.error(f"Snapshot lookup failed, starting empty: {e}")
+        return False
+    if not latest: return False
+    seq, data = latest
+    tmp = db_file + ".restore"
+    with open(tmp, "wb") as f:
+        f.write(gzip.decompress(data))
+    os.replace(tmp, db_file)
+    logger.info(f"Restored snapshot at seq {seq} into {db_file}")
+    return True
+
+snapshot_store = {'local': lambda: LocalSnapshotStore(SNAPSHOT_DIR),
+                  'telegram': lambda: TelegramSnapshotStore(SNAPSHOT_CHANNEL)}.get(SNAPSHOT_STORE, lambda: None)()
+if snapshot_store:
+    restore_snapshot(DB_NAME, snapshot_store)
+
+db = Database(DB_NAME, DB_POOL_SIZE)
+atexit.register(db.close)
+
+journal = snapshots = None
+if snapshot_store:
+    journal = ChangeJournal(snapshot_store, JOURNAL_FLUSH_INTERVAL)
+    try:
+        replayed = journal.recover(db)
+        if replayed: logger.info(f"Replayed {replayed} journaled transactions")
+    except Exception as e:
+        logger.error(f"Journal replay failed: {e}")
+    db.pool.attach_journal(journal)
+    atexit.register(journal.flush)  # registered early, so it runs after the other flush hooks (atexit is LIFO)
+    snapshots = Snapshotter(db, snapshot_store, SNAPSHOT_INTERVAL, SNAPSHOT_KEEP)
+    snapshot_store.on_full = snapshots.due.set
+if METRICS_ENABLED:
+    # Primitives and context managers are left alone; everything they serve is timed
+    instrument_methods(db, "db", skip=("connection", "transaction", "fetchone", "fetchall", "execute",
+                                       "close", "init_db", "migrate", "caches"))
+    metrics.gauge("filestore_cache_hits_total", lambda: [((("cache", n),), c.hits) for n, c in db.caches()], "Cache hits", "counter")
+    metrics.gauge("filestore_cache_misses_total", lambda: [((("cache", n),), c.misses) for n, c in db.caches()], "Cache misses", "counter")
+    metrics.gauge("filestore_cache_hit_ratio", lambda: [((("cache", n),), round(c.hit_rate, 4)) for n, c in db.caches()], "Cache hit ratio")
+    metrics.gauge("filestore_db_pool_waits_total", lambda: [((), db.pool.waits)], "Borrows that waited for a connection", "counter")
+    metrics.gauge("filestore_db_pool_wait_seconds_total", lambda: [((), round(db.pool.wait_seconds, 6))], "Time spent waiting for a connection", "counter")
+    if journal:
+        metrics.gauge("filestore_journal_pending", lambda: [((), journal.pending)], "Journaled transactions not yet shipped")
+        metrics.gauge("filestore_snapshot_age_seconds", lambda: [((), round(time.time() - snapshots.last_at) if snapshots.last_at else -1)], "Seconds since the last snapshot")
+    metrics.gauge("filestore_cache_entries", lambda: [((("cache", n),), len(c)) for n, c in db.caches()], "Cached entries")
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 📈 DOWNLOAD COUNTER (Write-Behind)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def hour_bucket(ts=None):
+    return time.strftime('%Y-%m-%d %H', time.gmtime(ts))
+
+class DownloadCounter:
+    """Collects downloads in memory and writes them in batches.
+
+    A crash loses at most one ``interval`` of counts; shutdown flushes.
+    """
+    def __init__(self, database, interval=10):
+        self.db = database
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def hit(self, code):
+        key = (code, hour_bucket())
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+
+    @property
+    def pending(self):
+        """Downloads counted but not yet flushed."""
+        with self._lock:
+            return sum(self._pending.values())
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch: return
+        try:
+            self.db.add_downloads(batch)
+        except sqlite3.Error as e:
+            logger.error(f"Download flush failed, retrying next tick: {e}")
+            with self._lock:
+                for key, n in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + n
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="download-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Final flush (atexit, also reached on SIGTERM); waits for a tick in progress so
+        every count is written before the journal's last flush."""
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+        self.flush()
+
+downloads = DownloadCounter(db, DOWNLOAD_FLUSH_INTERVAL)
+downloads.start()
+atexit.register(downloads.stop)
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 🛠️ UTILS & DECORATORS
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def generate_code(): return secrets.token_urlsafe(6)
+
+BUNDLE_PREFIX = "b_"  # bundle codes are 10 chars, so they never equal an 8-char file code
+
+def generate_bundle_code(): return BUNDLE_PREFIX + generate_code()
+
+class TokenBucket:
+    """Thread-safe token bucket. ``acquire`` blocks until a token is free."""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)  # a sub-1 bucket could never hold one token
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self, n):
+        """Returns 0 on success, else seconds to wait before retrying."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.rate: return 0  # unlimited, but pause() still holds it
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= n:
+            self._tokens -= n
+            return 0
+        return (n - self._tokens) / self.rate
+
+    def try_acquire(self, n=1):
+        with self._lock:
+            return self._take(n) == 0
+
+    def reserve(self, n=1):
+        """Takes ``n`` tokens if available (0), else returns seconds to wait; never blocks."""
+        with self._lock:
+            return self._take(n)
+
+    def acquire(self, n=1):
+        while True:
+            with self._lock:
+                wait = self._take(n)
+            if not wait: return
+            time.sleep(wait)
+
+    @property
+    def paused(self):
+        return time.monotonic() < self._paused_until
+
+    def pause(self, seconds):
+        """Stops handing out tokens for ``seconds`` (e.g. after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class FloodGuard:
+    """Per-user token buckets, checked before any DB or API work.
+
+    State per user is one small list: a token count per lane, the last
+    refill time, a strike count with its window start and a cooldown end.
+    Users whose buckets have refilled and who aren't cooling down carry no
+    information and are dropped by the periodic sweep, so the table only
+    holds users active in the last few seconds plus muted ones.
+    """
+    LAST, STRIKES, STRUCK_AT, MUTED_UNTIL = range(-4, 0)
+
+    def __init__(self, lanes, strikes=20, cooldown=300, sweep_interval=60):
+        self.lanes = {name: i for i, name in enumerate(lanes)}
+        self.rates = [rate for rate, _ in lanes.values()]
+        self.bursts = [burst for _, burst in lanes.values()]
+        self.strikes = strikes
+        self.cooldown = cooldown
+        self.sweep_interval = sweep_interval
+        self.idle_after = max((b / r for r, b in zip(self.rates, self.bursts) if r), default=0)
+        self._state = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.rejected = 0
+
+    def check(self, uid, lane, cost=1):
+        """'ok', 'limited' (drop silently) or 'muted' (just started a cooldown: tell the user once)."""
+        i = self.lanes[lane]
+        rate = self.rates[i]
+        if not rate or uid in ADMIN_LIST or uid == OWNER_ID:
+            return 'ok'
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            st = self._state.get(uid)
+            if st is None:
+                st = self._state[uid] = self.bursts + [now, 0, 0.0, 0.0]
+            else:
+                elapsed = now - st[self.LAST]
+                for j, r in enumerate(self.rates):
+                    st[j] = min(self.bursts[j], st[j] + elapsed * r)
+                st[self.LAST] = now
+            if now < st[self.MUTED_UNTIL]:
+                self.rejected += 1
+                return 'limited'
+            if st[i] >= cost:
+                st[i] -= cost
+                return 'ok'
+            self.rejected += 1
+            if now - st[self.STRUCK_AT] > self.cooldown:
+                st[self.STRIKES], st[self.STRUCK_AT] = 0, now
+            st[self.STRIKES] += 1
+            if st[self.STRIKES] < self.strikes:
+                return 'limited'
+            st[self.STRIKES], st[self.MUTED_UNTIL] = 0, now + self.cooldown
+        logger.warning(f"Flood control: user {uid} muted for {self.cooldown}s")
+        return 'muted'
+
+    def _sweep(self, now):
+        self._state = {uid: st for uid, st in self._state.items()
+                       if now - st[self.LAST] < self.idle_after or now < st[self.MUTED_UNTIL]
+                       or now - st[self.STRUCK_AT] < self.cooldown}
+        self._next_sweep = now + self.sweep_interval
+
+    def __len__(self):
+        return len(self._state)
+
+flood = FloodGuard({
+    'deeplink': (FLOOD_DEEPLINK_RATE, FLOOD_DEEPLINK_BURST),
+    'upload': (FLOOD_UPLOAD_RATE, FLOOD_UPLOAD_BURST),
+    'callback': (FLOOD_CALLBACK_RATE, FLOOD_CALLBACK_BURST),
+}, FLOOD_STRIKES, FLOOD_COOLDOWN, FLOOD_SWEEP_INTERVAL)
+
+FLOOD_TEXT = "🐢 **Slow down!** You're sending too much. Try again in a few minutes."
+
+def flood_lane(message):
+    """(lane, cost) a message is charged against."""
+    if message.content_type in ('document', 'photo', 'video', 'audio'):
+        return 'upload', (0.1 if message.media_group_id else 1)  # albums have at most 10 parts
+    return 'deeplink', 1
+
+
+def retry_after(exc):
+    """Seconds Telegram asked us to wait, or None if ``exc`` isn't a 429 (sync or async telebot)."""
+    if getattr(exc, 'error_code', None) == 429 and hasattr(exc, 'result_json'):
+        return (exc.result_json.get('parameters') or {}).get('retry_after', 1)
+    return None
+
+def is_unreachable(exc):
+    """User blocked the bot, deleted their account or never started it."""
+    return isinstance(exc, ApiTelegramException) and (
+        exc.error_code == 403 or (exc.error_code == 400 and 'chat not found' in exc.description))
+
+class OutboundScheduler:
+    """The one path every Bot API request takes (sync telebot and AsyncTeleBot).
+
+    Message-sending methods spend a token from the global bucket and from the
+    target chat's bucket (private chats and groups/channels have separate
+    rates; idle chat buckets are swept). Chat pacing never holds a thread for
+    more than ``chat_max_wait``: past that the request goes out and Telegram's
+    429 is the limit. A 429 pauses only that chat's bucket for retry_after and
+    the request is retried, up to ``max_retries`` times and ``max_wait``
+    seconds per wait; inside ``no_retry()`` it is raised at once so the caller
+    can fail over. All sync requests share one keep-alive session.
+    """
+    SEND_METHODS = frozenset({"sendMessage", "copyMessage", "copyMessages", "forwardMessage", "forwardMessages",
+                              "sendMediaGroup", "sendDocument", "sendPhoto", "sendVideo", "sendAudio",
+                              "editMessageText", "editMessageCaption", "editMessageReplyMarkup"})
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=5, group_rate=0, group_burst=20,
+                 max_wait=30, max_retries=3, chat_max_wait=1, sweep_interval=60):
+        self.global_bucket = TokenBucket(global_rate) if global_rate else None
+        self.chat_limits = {True: (chat_rate, chat_burst), False: (group_rate, group_burst)}  # private? -> limits
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.chat_max_wait = chat_max_wait
+        self.sweep_interval = sweep_interval
+        self._chats = {}  # chat_id -> [TokenBucket, last used]
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._retry = contextvars.ContextVar("outbound_retry", default=True)
+        self.waited = 0.0   # seconds spent waiting for tokens or retry_after
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id):
+        """The chat's bucket; with a 0 rate it only carries 429 pauses."""
+        try: chat_id = int(chat_id)
+        except (TypeError, ValueError): return None  # @channel usernames
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._chats = {c: e for c, e in self._chats.items() if now - e[1] < self.sweep_interval}
+                self._next_sweep = now + self.sweep_interval
+            entry = self._chats.get(chat_id)
+            if entry is None:
+                entry = self._chats[chat_id] = [TokenBucket(*self.chat_limits[chat_id > 0]), now]
+            entry[1] = now
+            return entry[0]
+
+    def plan(self, method_name, params):
+        """(tokens, chat bucket) a request has to pay for; a media group costs one per item."""
+        if method_name not in self.SEND_METHODS: return 0, None
+        params = params or {}
+        n = 1
+        if method_name in ("sendMediaGroup", "forwardMessages", "copyMessages"):
+            raw = params.get("media") or params.get("message_ids") or "[]"
+            n = max(1, len(json.loads(raw) if isinstance(raw, str) else raw))
+        return n, self._chat_bucket(params.get("chat_id"))
+
+    def _waits(self, n, chat):
+        """Yields the sleeps a send needs: global tokens first, then the chat's (or its 429 pause)."""
+        if self.global_bucket:
+            while (wait := self.global_bucket.reserve(min(n, self.global_bucket.capacity))):
+                yield wait
+        if chat:
+            while (wait := chat.reserve(min(n, chat.capacity))):
+                if wait > self.chat_max_wait and not chat.paused: return
+                yield wait
+
+    @contextmanager
+    def no_retry(self, enabled=True):
+        """429s raised inside are not retried here (the chat is still paused), so the caller can fail over."""
+        token = self._retry.set(not enabled)
+        try: yield
+        finally: self._retry.reset(token)
+
+    def _backoff(self, chat, error, attempt):
+        """Seconds to wait before retrying ``error``; re-raises when it shouldn't be retried."""
+        wait = retry_after(error)
+        if wait is None or wait > self.max_wait:
+            raise error
+        if chat: chat.pause(wait)  # only this chat: other chats and the global bucket keep going
+        if attempt >= self.max_retries or not self._retry.get():
+            raise error
+        with self._lock:
+            self.retries += 1
+        return wait
+
+    def _waited(self, seconds):
+        with self._lock:
+            self.waited += seconds
+
+    def request(self, make_request, token, method_name, *args, **kwargs):
+        params = kwargs.get("params", args[1] if len(args) > 1 else None)
+        n, chat = self.plan(method_name, params)
+        for attempt in range(self.max_retries + 1):
+            for wait in self._waits(n, chat):
+                self._waited(wait)
+                time.sleep(wait)
+            try:
+                return make_request(token, method_name, *args, **kwargs)
+            except ApiTelegramException as e:
+                wait = self._backoff(chat, e, attempt)
+                if not chat:  # else the chat's pause is waited out above
+                    self._waited(wait)
+                    time.sleep(wait)
+
+    async def request_async(self, process_request, token, url, *args, **kwargs):
+        n, chat = self.plan(url, kwargs.get("params", args[1] if len(args) > 1 else None))
+        for attempt in range(self.max_retries + 1):
+            for wait in self._waits(n, chat):
+                self._waited(wait)
+                await asyncio.sleep(wait)
+            try:
+                return await process_request(token, url, *args, **kwargs)
+            except Exception as e:
+                wait = self._backoff(chat, e, attempt)
+                if not chat:
+                    self._waited(wait)
+                    await asyncio.sleep(wait)
+
+    def install(self, pool_size=32):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        apihelper.session = session
+        make_request = apihelper._make_request  # already timed when METRICS=1
+        apihelper._make_request = lambda token, method_name, *a, **kw: self.request(make_request, token, method_name, *a, **kw)
+
+    def install_async(self, asyncio_helper):
+        process_request = asyncio_helper._process_request
+        async def scheduled(token, url, *args, **kwargs):
+            return await self.request_async(process_request, token, url, *args, **kwargs)
+        asyncio_helper._process_request = scheduled
+
+outbound = OutboundScheduler(API_GLOBAL_RATE, API_CHAT_RATE, API_CHAT_BURST, API_GROUP_RATE, API_GROUP_BURST,
+                             API_MAX_RETRY_WAIT, API_MAX_RETRIES, API_CHAT_MAX_WAIT)
+outbound.install(API_POOL_SIZE)
+
+@lru_cache(maxsize=None)
+def bot_me():
+    """The bot's own User, fetched once per process (username for links and captions)."""
+    return bot.get_me()
+
+def is_admin(func):
+    @wraps(func)
+    def wrapper(message, *args, **kwargs):
+        if message.from_user.id not in ADMIN_LIST and message.from_user.id != OWNER_ID:
+            return
+        return func(message, *args, **kwargs)
+    return wrapper
+
+MAINTENANCE_TEXT = "⚠️ **System is under maintenance.**\nPlease try again later."
+
+def user_gate(uid):
+    """Why ``uid`` may not use the bot right now: 'banned', 'maintenance' or None."""
+    role, banned = db.get_user_status(uid)
+    if banned: return 'banned'
+    
+    # Check Maintenance Mode (Admins bypass)
+    m_mode = db.get_setting("maintenance_mode") == "1"
+    if m_mode and uid not in ADMIN_LIST and uid != OWNER_ID:
+        return 'maintenance'
+    return None
+
+def admission(message):
+    """Spends a flood token for ``message`` and checks the user gate.
+
+    Returns None if it may be handled, else the reply it gets ('' to drop
+    it silently). Shared by the threaded and the async runtime.
+    """
+    verdict = flood.check(message.from_user.id, *flood_lane(message))
+    if verdict != 'ok':
+        return FLOOD_TEXT if verdict == 'muted' else ''
+    gate = user_gate(message.from_user.id)
+    if gate:
+        return MAINTENANCE_TEXT if gate == 'maintenance' else ''
+    return None
+
+def check_user(func):
+    @wraps(func)
+    def wrapper(message, *args, **kwargs):
+        refusal = admission(message)
+        if refusal is not None:
+            if refusal: bot.reply_to(message, refusal)
+            return
+        return func(message, *args, **kwargs)
+    return wrapper
+
+def file_info(message):
+    """(file_id, file_unique_id, name, mime) of a stored-type message, else None."""
+    if message.document:
+        return message.document.file_id, message.document.file_unique_id, message.document.file_name, message.document.mime_type
+    elif message.video:
+        return message.video.file_id, message.video.file_unique_id, "video.mp4", "video/mp4"
+    elif message.audio:
+        return message.audio.file_id, message.audio.file_unique_id, "audio.mp3", "audio/mpeg"
+    elif message.photo:
+        return message.photo[-1].file_id, message.photo[-1].file_unique_id, "photo.jpg", "image/jpeg"
+    return None
+
+class LogShipper:
+    """Ships audit lines to the log channel from one background thread.
+
+    Entries queued during an interval are merged into as few messages as the
+    4096-char limit allows; on overflow entries are dropped and counted.
+    """
+    LIMIT = 4096
+
+    def __init__(self, chat_id, interval=3, maxsize=1000):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def put(self, text):
+        try: self.queue.put_nowait(f"📝 `{text}`")
+        except queue.Full: self.dropped += 1
+
+    def _batches(self):
+        lines = []
+        while True:
+            try: lines.append(self.queue.get_nowait())
+            except queue.Empty: break
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(f"⚠️ `{dropped} log entries dropped (queue full)`")
+
+        chunk = ""
+        for line in lines:
+            line = line[:self.LIMIT]
+            if chunk and len(chunk) + 1 + len(line) > self.LIMIT:
+                yield chunk
+                chunk = ""
+            chunk = f"{chunk}\n{line}" if chunk else line
+        if chunk: yield chunk
+
+    def _send(self, text):
+        try:  # 429s are waited out by the outbound scheduler
+            bot.send_message(self.chat_id, text, disable_notification=True)
+        except Exception as e:
+            logger.warning(f"Log channel send failed: {e}")
+
+    def flush(self):
+        for text in self._batches():
+            self._send(text)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+        self.flush()
+
+log_shipper = LogShipper(LOG_CHANNEL, LOG_FLUSH_INTERVAL, LOG_QUEUE_SIZE)
+if LOG_CHANNEL:
+    log_shipper.start()
+    atexit.register(log_shipper.stop)
+
+def log(text):
+    if LOG_CHANNEL: log_shipper.put(text)
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 🎮 MENUS & UI (INLINE KEYBOARDS)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+def welcome_text(first_name):
+    return (
+        f"👋 **Hello, {first_name}!**\n"
+        f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
+        f"☁️ **Advanced File Store Bot**\n\n"
+        f"🔹 Send me **any file** to store it.\n"
+        f"🔹 I will provide a **permanent link**.\n"
+        f"🔹 Create **Personal Channels** for storage.\n\n"
+        f"🚀 _Powered by Render & SQLite_"
+    )
+
+def help_text(user_id):
+    is_adm = user_id in ADMIN_LIST or user_id == OWNER_ID
+    
+    txt = "📚 **COMMAND LIST**\n▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n\n"
+    txt += "👤 **User Commands:**\n"
+    txt += "• `/start` - Main Menu\n"
+    txt += "• `/myfiles` - View your files\n"
+    txt += "• `/search <words>` - Find your files by name\n"
+    txt += "• `/bundle <codes>` - One link for several files\n"
+    txt += "• `@bot <words>` - Share your files inline in any chat\n"
+    txt += "• `/connect_channel` - Link custom storage\n"
+    txt += "• `/disconnect` - Unlink channel\n\n"
+    
+    if is_adm:
+        txt += "🛡️ **Admin Commands:**\n"
+        txt += "• `/admin` - Open Admin Dashboard\n"
+        txt += "• `/stats` - Quick server stats\n"
+        txt += "• `/ban <id>` - Ban a user\n"
+    return txt
+
+def delivery_caption(name, username):
+    return f"📄 `{name}`\n🤖 via @{username}"
 
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# 🛠️ UTILS & DECORATORS
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+NOT_FOUND_TEXT = "❌ **File Not Found**\nIt may have been deleted."
+UNAVAILABLE_TEXT = "⚠️ **Error:** content unavailable."
 
-def generate_code(): return secrets.token_urlsafe(6)
+def start_target(message, username):
+    """DB half of /start, shared by both runtimes.
 
-def is_admin(func):
-    @wraps(func)
-    def wrapper(message, *args, **kwargs):
-        if message.from_user.id not in ADMIN_LIST and message.from_user.id != OWNER_ID:
-            return
-        return func(message, *args, **kwargs)
-    return wrapper
+    Registers the user and resolves a deep link. Returns (kind, code, rec):
+    'welcome' for a plain /start, 'bundle' once a bundle delivery is queued,
+    'missing' for an unknown code, else 'file' with its FileRecord.
+    """
+    db.add_user(message.from_user.id)
+    args = message.text.split()
+    if len(args) < 2:
+        return 'welcome', None, None
+    code = args[1]
+    if code.startswith(BUNDLE_PREFIX) and deliver_bundle(message.chat.id, code, username):
+        return 'bundle', code, None
+    rec = db.resolve_file(code)
+    return ('file' if rec else 'missing'), code, rec
 
-def check_user(func):
-    @wraps(func)
-    def wrapper(message, *args, **kwargs):
-        uid = message.from_user.id
-        role, banned = db.get_user_status(uid)
-        if banned: return
-        
-        # Check Maintenance Mode (Admins bypass)
-        m_mode = db.get_setting("maintenance_mode") == "1"
-        if m_mode and uid not in ADMIN_LIST and uid != OWNER_ID:
-            bot.reply_to(message, "⚠️ **System is under maintenance.**\nPlease try again later.")
-            return
-            
-        return func(message, *args, **kwargs)
-    return wrapper
+def upload_lookup(user_id, unique):
+    """DB half of an upload before any forward: (user's channel, stored copy to reuse or None)."""
+    db.add_user(user_id)
+    user_channel = db.get_channel(user_id)
+    return user_channel, db.find_stored_copy(unique, [user_channel] if user_channel else storage.channels, user_id)
 
-def log(text):
-    if LOG_CHANNEL:
-        try: bot.send_message(LOG_CHANNEL, f"📝 `{text}`")
-        except: pass
+def save_upload(message, info, existing, stored, username):
+    """DB half of an upload after the forward; returns the success reply (text, keyboard).
 
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# 🎮 MENUS & UI (INLINE KEYBOARDS)
-# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+    ``stored`` is the (channel, message_id) the file was forwarded to, or
+    None when ``existing`` is reused.
+    """
+    fid, unique, name, mime = info
+    user_id = message.from_user.id
+    if existing and existing[2] == user_id:
+        code = existing[0]  # same user re-sent the same file: hand back the same link
+    else:
+        storage_channel, stored_id = stored or (existing[3], existing[1])
+        code = generate_code()
+        db.add_file(code, name, mime, fid, unique, stored_id, storage_channel, user_id, message.content_type)
+    log(f"User {user_id} uploaded {code}")
+    return upload_result(name, code, f"https://t.me/{username}?start={code}")
+
+def upload_result(name, code, link):
+    res_text = (
+        f"✅ **File Saved Successfully!**\n"
+        f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
+        f"📂 **Name:** `{name}`\n"
+        f"🔐 **Code:** `{code}`\n\n"
+        f"🔗 **Share Link:**\n`{link}`"
+    )
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton("🔁 Share Link", url=f"https://t.me/share/url?url={link}"))
+    return res_text, kb
+
+HOME_TEXT = "☁️ **Advanced File Store**\nSelect an option:"
 
 def main_menu_keyboard(user_id):
     kb = types.InlineKeyboardMarkup(row_width=2)
@@ -243,6 +1917,40 @@ def main_menu_keyboard(user_id):
         kb.add(types.InlineKeyboardButton("🛡️ Admin Panel", callback_data="admin_panel"))
     return kb
 
+def my_files_page(user_id, data=None, username=None):
+    """Text + keyboard for one page of the file browser.
+
+    ``data`` is the callback payload ``mf:<n|p>:<created_at>|<code>`` (None = first page).
+    """
+    after = before = None
+    if data:
+        direction, key = data[3], tuple(data[5:].rsplit("|", 1))
+        if direction == "n": after = key
+        else: before = key
+
+    rows, more = db.get_user_files_page(user_id, FILES_PAGE_SIZE, after=after, before=before)
+    if not rows and (after or before):  # cursor went stale (files deleted) -> restart
+        rows, more = db.get_user_files_page(user_id, FILES_PAGE_SIZE)
+        after = before = None
+    has_newer = (before and more) or bool(after)
+    has_older = more if not before else True
+
+    total = db.get_user_files_stats(user_id)
+    txt = f"📂 **My Files** (`{total}` stored)\n▬▬▬▬▬▬▬▬▬▬▬▬▬▬"
+    if not rows: txt += "\n\n_No files yet. Send me any file to store it._"
+
+    me = username or bot_me().username
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    for created, code, name in rows:
+        kb.add(types.InlineKeyboardButton(f"📄 {name or code}", url=f"https://t.me/{me}?start={code}"))
+
+    nav = []
+    if has_newer: nav.append(types.InlineKeyboardButton("⬅️ Newer", callback_data=f"mf:p:{rows[0][0]}|{rows[0][1]}"))
+    if rows and has_older: nav.append(types.InlineKeyboardButton("Older ➡️", callback_data=f"mf:n:{rows[-1][0]}|{rows[-1][1]}"))
+    if nav: kb.row(*nav)
+    kb.add(types.InlineKeyboardButton("🔙 Back to Home", callback_data="home"))
+    return txt, kb
+
 def admin_keyboard():
     m_mode = db.get_setting("maintenance_mode") == "1"
     status_icon = "🔴" if m_mode else "🟢"
@@ -254,6 +1962,7 @@ def admin_keyboard():
         types.InlineKeyboardButton("🚫 Ban User", callback_data="adm_ban"),
         types.InlineKeyboardButton("🔓 Unban User", callback_data="adm_unban"),
         types.InlineKeyboardButton("🗑 Delete File", callback_data="adm_del"),
+        types.InlineKeyboardButton("🔥 Top Files", callback_data="adm_top"),
         types.InlineKeyboardButton(f"Maintenance: {status_icon}", callback_data="adm_maint_toggle")
     )
     kb.add(types.InlineKeyboardButton("🔙 Back to Home", callback_data="home"))
@@ -264,121 +1973,446 @@ def admin_keyboard():
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 @bot.message_handler(commands=['start'])
+@timed("start_command")
 @check_user
 def start_command(message):
-    db.add_user(message.from_user.id)
-    args = message.text.split()
-    
-    # ➤ DEEP LINK HANDLING
-    if len(args) > 1:
-        code = args[1]
-        file_data = db.get_file(code)
-        
-        if not file_data:
-            bot.reply_to(message, "❌ **File Not Found**\nIt may have been deleted.")
-            return
+    kind, code, rec = start_target(message, bot_me().username)
 
-        # (code, name, mime, fid, uid, msg_id, chan_id, uploader, dl, vis, time)
-        channel_id = file_data[6]
-        msg_id = file_data[5]
-        name = file_data[1]
-        
+    # ➤ DEEP LINK HANDLING
+    if kind == 'missing':
+        bot.reply_to(message, NOT_FOUND_TEXT)
+    elif kind == 'file':
         try:
-            bot.copy_message(message.chat.id, channel_id, msg_id, caption=f"📄 `{name}`\n🤖 via @{bot.get_me().username}")
-            db.add_download(code)
-        except Exception:
-            bot.reply_to(message, "⚠️ **Error:** content unavailable.")
-    
+            bot.copy_message(message.chat.id, rec.channel_id, rec.message_id, caption=delivery_caption(rec.name, bot_me().username))
+            downloads.hit(code)
+        except ApiTelegramException as e:  # 429s were already waited out by the outbound scheduler
+            logger.warning(f"Delivery of {code} to {message.chat.id} failed: {e}")
+            bot.reply_to(message, UNAVAILABLE_TEXT)
+
     # ➤ NORMAL START
-    else:
-        txt = (
-            f"👋 **Hello, {message.from_user.first_name}!**\n"
-            f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
-            f"☁️ **Advanced File Store Bot**\n\n"
-            f"🔹 Send me **any file** to store it.\n"
-            f"🔹 I will provide a **permanent link**.\n"
-            f"🔹 Create **Personal Channels** for storage.\n\n"
-            f"🚀 _Powered by Render & SQLite_"
-        )
-        bot.send_message(message.chat.id, txt, reply_markup=main_menu_keyboard(message.from_user.id))
+    elif kind == 'welcome':
+        bot.send_message(message.chat.id, welcome_text(message.from_user.first_name), reply_markup=main_menu_keyboard(message.from_user.id))
+
+@bot.message_handler(commands=['myfiles'])
+@timed("my_files_command")
+@check_user
+def my_files_command(message):
+    txt, kb = my_files_page(message.from_user.id)
+    bot.reply_to(message, txt, reply_markup=kb)
 
 @bot.message_handler(commands=['help'])
+@timed("help_command")
 @check_user
 def help_command(message):
-    user_id = message.from_user.id
-    is_adm = user_id in ADMIN_LIST or user_id == OWNER_ID
-    
-    txt = "📚 **COMMAND LIST**\n▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n\n"
-    txt += "👤 **User Commands:**\n"
-    txt += "• `/start` - Main Menu\n"
-    txt += "• `/myfiles` - View your files\n"
-    txt += "• `/connect_channel` - Link custom storage\n"
-    txt += "• `/disconnect` - Unlink channel\n\n"
-    
-    if is_adm:
-        txt += "🛡️ **Admin Commands:**\n"
-        txt += "• `/admin` - Open Admin Dashboard\n"
-        txt += "• `/stats` - Quick server stats\n"
-        txt += "• `/ban <id>` - Ban a user\n"
-    
-    bot.reply_to(message, txt)
+    bot.reply_to(message, help_text(message.from_user.id))
+
+@bot.message_handler(commands=['search'])
+@timed("search_command")
+@check_user
+def search_command(message):
+    parts = message.text.split(maxsplit=1)
+    text = parts[1] if len(parts) > 1 else ""
+    if not text.strip():
+        bot.reply_to(message, "🔎 **Usage:** `/search <part of the file name>`")
+        return
+    rows = db.search_files(message.from_user.id, text, SEARCH_RESULTS)
+    if not rows:
+        bot.reply_to(message, "🔎 **No matching files.**\nOnly files you uploaded are searched.")
+        return
+    me = bot_me().username
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    for code, name, _, _ in rows:
+        kb.add(types.InlineKeyboardButton(f"📄 {name or code}", url=f"https://t.me/{me}?start={code}"))
+    bot.reply_to(message, f"🔎 **Results** ({len(rows)})", reply_markup=kb)
+
+# Inline answers per (user, query); Telegram caches them client-side for INLINE_CACHE_TIME too
+inline_cache = TTLCache(10000, 30)
+
+# Names file_info() gives photos, videos and audio; rows stored before media_kind was recorded
+# under such a name may hold a file_id of a different type than their kind says
+PLACEHOLDER_NAMES = ("photo.jpg", "video.mp4", "audio.mp3")
+
+def inline_results(user_id, query, strict=False):
+    """Cached-media results that resend the stored file_id: no copy_message, no extra round trip.
+
+    ``strict`` leaves out rows named like PLACEHOLDER_NAMES, whose kind may not match the file_id.
+    """
+    key = (user_id, query.strip().lower(), strict)
+    results = inline_cache.get(key, _MISS)
+    if results is not _MISS: return results
+    me = bot_me().username
+    results = []
+    for code, name, file_id, kind in db.search_files(user_id, query, INLINE_RESULTS):
+        if strict and name in PLACEHOLDER_NAMES: continue
+        caption, title = delivery_caption(name, me), name or code
+        if kind == 'photo':
+            results.append(types.InlineQueryResultCachedPhoto(code, file_id, title=title, caption=caption, parse_mode="Markdown"))
+        elif kind == 'video':
+            results.append(types.InlineQueryResultCachedVideo(code, file_id, title, caption=caption, parse_mode="Markdown"))
+        elif kind == 'audio':
+            results.append(types.InlineQueryResultCachedAudio(code, file_id, caption=caption, parse_mode="Markdown"))
+        else:
+            results.append(types.InlineQueryResultCachedDocument(code, file_id, title, caption=caption, parse_mode="Markdown"))
+    inline_cache.set(key, results)
+    return results
+
+@bot.inline_handler(func=lambda query: True)
+@timed("inline_query")
+def inline_query(query):
+    uid = query.from_user.id
+    if flood.check(uid, 'callback') != 'ok' or user_gate(uid): return
+    results = inline_results(uid, query.query)
+    try:
+        bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+    except ApiTelegramException as e:
+        # One result whose file_id doesn't fit its kind fails the whole answer
+        if e.error_code != 400: raise
+        logger.warning(f"Inline answer for {uid} rejected ({e.description}); retrying without unverified kinds")
+        bot.answer_inline_query(query.id, inline_results(uid, query.query, strict=True),
+                                cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 📦 BUNDLES (One Link, Many Files)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+MEDIA_GROUP_KIND = {'photo': 'visual', 'video': 'visual', 'document': 'document', 'audio': 'audio'}
+INPUT_MEDIA = {'photo': types.InputMediaPhoto, 'video': types.InputMediaVideo,
+               'document': types.InputMediaDocument, 'audio': types.InputMediaAudio}
+
+def bundle_groups(items):
+    """Splits bundle rows into sendMediaGroup-compatible runs of at most 10.
+
+    Photos and videos may share an album; documents and audio only group with
+    their own kind. Rows without a stored file_id are sent on their own.
+    """
+    groups = []
+    for item in items:
+        kind = MEDIA_GROUP_KIND.get(item[5]) if item[4] else None
+        last = groups[-1] if groups else None
+        if kind and last and last[0] == kind and len(last[1]) < 10:
+            last[1].append(item)
+        else:
+            groups.append([kind, [item]])
+    return [group for _, group in groups]
+
+def send_bundle(chat_id, items, username):
+    """Delivers a bundle: one sendMediaGroup per group, paced per chat (the outbound scheduler waits out 429s).
+
+    A group Telegram rejects with 400 is sent as one copy_message per file: rows
+    stored before media kinds were recorded are 'document' whatever their file_id is,
+    and copy_message works for any stored type.
+    """
+    def copy_items(group, last_group):
+        for i, (code, channel, msg_id, name) in enumerate(item[:4] for item in group):
+            closing = last_group and i == len(group) - 1
+            bot.copy_message(chat_id, channel, msg_id, caption=delivery_caption(name, username) if closing else f"📄 `{name}`")
+
+    groups = bundle_groups(items)
+    sent = 0
+    for n, group in enumerate(groups):
+        if n: time.sleep(BUNDLE_GROUP_INTERVAL)
+        last_group = n == len(groups) - 1
+        try:
+            if len(group) == 1:
+                copy_items(group, last_group)
+            else:
+                media = [INPUT_MEDIA[kind](file_id, caption=f"📄 `{name}`", parse_mode="Markdown")
+                         for _, _, _, name, file_id, kind in group]
+                if last_group:
+                    media[-1].caption = delivery_caption(group[-1][3], username)
+                try:
+                    bot.send_media_group(chat_id, media)
+                except ApiTelegramException as e:
+                    if e.error_code != 400: raise
+                    logger.warning(f"Bundle group for {chat_id} rejected ({e.description}); copying one by one")
+                    copy_items(group, last_group)
+        except Exception as e:
+            logger.warning(f"Bundle delivery to {chat_id} stopped after {sent} files: {e}")
+            bot.send_message(chat_id, f"⚠️ **Only {sent} of {len(items)} files could be sent.** Try the link again later.")
+            return
+        for item in group:
+            downloads.hit(item[0])
+        sent += len(group)
+
+# Bundle deliveries sleep between groups, so they get their own threads instead of a handler worker
+bundle_sender = ThreadPoolExecutor(max_workers=BUNDLE_WORKERS, thread_name_prefix="bundle")
+
+def deliver_bundle(chat_id, code, username):
+    """Queues delivery of bundle ``code``; False if no such bundle (or all its files are gone)."""
+    items = db.get_bundle(code)
+    if not items: return False
+    bundle_sender.submit(send_bundle, chat_id, items, username).add_done_callback(
+        lambda f: f.exception() and logger.error(f"Bundle {code} failed: {f.exception()}"))
+    return True
+
+def bundle_result(count, code, link):
+    res_text = (
+        f"📦 **Bundle Created!**\n"
+        f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
+        f"🗂 **Files:** `{count}`\n"
+        f"🔐 **Code:** `{code}`\n\n"
+        f"🔗 **Share Link:**\n`{link}`"
+    )
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton("🔁 Share Link", url=f"https://t.me/share/url?url={link}"))
+    return res_text, kb
+
+@bot.message_handler(commands=['bundle'])
+@timed("bundle_command")
+@check_user
+def bundle_command(message):
+    # Codes or full ?start= links, in the order given
+    wanted = list(dict.fromkeys(t.rsplit("start=", 1)[-1] for t in message.text.split()[1:]))[:BUNDLE_MAX_FILES]
+    found = db.existing_codes(wanted) if wanted else set()
+    codes = [c for c in wanted if c in found]
+    if len(codes) < 2:
+        bot.reply_to(message, f"📦 **Usage:** `/bundle <code> <code> ...`\nSend at least 2 file codes or links (max {BUNDLE_MAX_FILES}).")
+        return
+    code = db.create_bundle(generate_bundle_code(), message.from_user.id, codes)
+    res_text, kb = bundle_result(len(codes), code, f"https://t.me/{bot_me().username}?start={code}")
+    bot.reply_to(message, res_text, reply_markup=kb)
+    log(f"User {message.from_user.id} bundled {len(codes)} files as {code}")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 📤 FILE UPLOAD HANDLER
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
+class StoragePool:
+    """Picks the storage channel for uploads that don't go to a user's own channel.
+
+    Policies: ``round_robin``, ``least_throttled`` (the channel whose last 429
+    is oldest) and ``hash`` (stable channel per file_unique_id). A channel that
+    answered 429 is skipped until its retry_after has passed; if every channel
+    is throttled the one that frees up first is used.
+    """
+    POLICIES = ('round_robin', 'least_throttled', 'hash')
+
+    def __init__(self, channels, policy='round_robin'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"STORAGE_POLICY must be one of {', '.join(self.POLICIES)}")
+        self.channels = list(dict.fromkeys(c for c in channels if c))
+        self.policy = policy
+        self.throttled_until = dict.fromkeys(self.channels, 0.0)
+        self.last_throttled = dict.fromkeys(self.channels, 0.0)
+        self.placed = dict.fromkeys(self.channels, 0)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def pick(self, key=None):
+        now = time.monotonic()
+        with self._lock:
+            n = len(self.channels)
+            if self.policy == 'hash' and key is not None:
+                start = zlib.crc32(str(key).encode()) % n
+            elif self.policy == 'least_throttled':
+                start = min(range(n), key=lambda i: (self.last_throttled[self.channels[i]], self.placed[self.channels[i]]))
+            else:
+                start, self._next = self._next, (self._next + 1) % n
+            order = [self.channels[(start + i) % n] for i in range(n)]
+            channel = next((c for c in order if self.throttled_until[c] <= now), None) \
+                or min(order, key=self.throttled_until.get)
+            self.placed[channel] += 1
+            return channel
+
+    def throttle(self, channel, seconds):
+        if channel not in self.throttled_until: return
+        with self._lock:
+            self.last_throttled[channel] = time.monotonic()
+            self.throttled_until[channel] = self.last_throttled[channel] + seconds
+        logger.warning(f"Storage channel {channel} throttled for {seconds}s")
+
+    def __len__(self):
+        return len(self.channels)
+
+storage = StoragePool([BIN_CHANNEL] + STORAGE_CHANNELS, STORAGE_POLICY)
+
+def storage_attempts(user_channel, key):
+    """(channel, last) for each try at storing ``key``: the user's channel, else the pool in failover order."""
+    if user_channel:
+        yield user_channel, True
+        return
+    for attempt in range(len(storage)):
+        yield storage.pick(key), attempt == len(storage) - 1
+
+def storage_failover(channel, exc, last):
+    """True if the next channel should be tried after ``exc`` (``channel`` is throttled then)."""
+    wait = retry_after(exc)
+    if wait is None or last: return False
+    storage.throttle(channel, wait)
+    return True
+
+def place_in_storage(user_channel, key, forward):
+    """Runs ``forward(channel)`` on the user's channel, else on a pooled one.
+
+    A 429 takes that pool channel out of rotation and the next one is tried;
+    only the last try waits out retry_after in the outbound scheduler.
+    Returns (channel, result of ``forward``).
+    """
+    for channel, last in storage_attempts(user_channel, key):
+        try:
+            with outbound.no_retry(not last):
+                return channel, forward(channel)
+        except ApiTelegramException as e:
+            if not storage_failover(channel, e, last): raise
+
 @bot.message_handler(content_types=['document', 'photo', 'video', 'audio'])
+@timed("handle_file")
 @check_user
 def handle_file(message):
     # 1. Get File Info
-    if message.document:
-        fid, unique, name, mime = message.document.file_id, message.document.file_unique_id, message.document.file_name, message.document.mime_type
-    elif message.video:
-        fid, unique, name, mime = message.video.file_id, message.video.file_unique_id, "video.mp4", "video/mp4"
-    elif message.audio:
-        fid, unique, name, mime = message.audio.file_id, message.audio.file_unique_id, "audio.mp3", "audio/mpeg"
-    elif message.photo:
-        fid, unique, name, mime = message.photo[-1].file_id, message.photo[-1].file_unique_id, "photo.jpg", "image/jpeg"
-    else: return
+    info = file_info(message)
+    if not info: return
+    fid, unique, name, mime = info
+
+    # Albums are stored together once the whole group has arrived
+    if message.media_group_id:
+        media_groups.add(message)
+        return
 
-    user_id = message.from_user.id
-    db.add_user(user_id)
-    
     # 2. UI Feedback
     status = bot.reply_to(message, "⚡ **Processing...**")
-    
-    # 3. Determine Storage Channel
-    storage_channel = db.get_channel(user_id) or BIN_CHANNEL
-    
+
     try:
-        # 4. Forward to Storage
-        fwd = bot.forward_message(storage_channel, message.chat.id, message.message_id)
-        
-        # 5. Generate Data
-        code = generate_code()
-        link = f"https://t.me/{bot.get_me().username}?start={code}"
-        
-        # 6. Save DB
-        db.add_file(code, name, mime, fid, unique, fwd.message_id, storage_channel, user_id)
-        
-        # 7. Success Response
-        res_text = (
-            f"✅ **File Saved Successfully!**\n"
-            f"▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
-            f"📂 **Name:** `{name}`\n"
-            f"🔐 **Code:** `{code}`\n\n"
-            f"🔗 **Share Link:**\n`{link}`"
-        )
-        
-        kb = types.InlineKeyboardMarkup()
-        kb.add(types.InlineKeyboardButton("🔁 Share Link", url=f"https://t.me/share/url?url={link}"))
-        
+        # 3. Storage channel (the user's own, else the shared pool) and any copy to reuse
+        user_channel, existing = upload_lookup(message.from_user.id, unique)
+
+        # 4. Forward to Storage unless a stored copy is reused
+        stored = None
+        if not existing:
+            channel, fwd = place_in_storage(user_channel, unique,
+                lambda ch: bot.forward_message(ch, message.chat.id, message.message_id))
+            stored = channel, fwd.message_id
+
+        # 5. Save + Success Response
+        res_text, kb = save_upload(message, info, existing, stored, bot_me().username)
         bot.edit_message_text(res_text, message.chat.id, status.message_id, reply_markup=kb)
-        log(f"User {user_id} uploaded {code}")
-        
+
     except Exception as e:
         bot.edit_message_text(f"❌ **Error:** {e}", message.chat.id, status.message_id)
 
+def forward_messages(chat_id, from_chat_id, message_ids):
+    """Forwards several messages in one Bot API call (forwardMessages).
+
+    Returns the new message ids in order, None for a message that couldn't
+    be forwarded. Falls back to one forward per message when the API server
+    doesn't know the method, or when it skipped some of the messages (their
+    copies are deleted first so the channel keeps no orphans).
+    """
+    try:
+        res = apihelper._make_request(bot.token, 'forwardMessages', method='post', params={
+            'chat_id': chat_id, 'from_chat_id': from_chat_id, 'message_ids': json.dumps(message_ids)})
+        ids = [m['message_id'] for m in res]
+        if len(ids) == len(message_ids): return ids
+        # Telegram silently skips messages it can't forward, so the ids no longer pair up
+        logger.warning("forwardMessages returned %d of %d messages; forwarding one by one", len(ids), len(message_ids))
+        for mid in ids:
+            try: bot.delete_message(chat_id, mid)
+            except ApiTelegramException as e: logger.warning(f"Orphaned forward {mid} in {chat_id} not deleted: {e}")
+    except ApiTelegramException as e:
+        if e.error_code not in (400, 404) or 'not found' not in e.description.lower(): raise
+    ids = []
+    for mid in message_ids:
+        try:
+            ids.append(bot.forward_message(chat_id, from_chat_id, mid).message_id)
+        except ApiTelegramException as e:
+            if retry_after(e) is not None: raise  # a throttled channel: let the storage pool fail over
+            logger.warning(f"Message {mid} from {from_chat_id} not forwarded: {e}")
+            ids.append(None)
+    return ids
+
+class MediaGroupCollector:
+    """Buffers album messages by media_group_id until the group goes quiet.
+
+    Telegram delivers an album as separate updates a few ms apart; once no new
+    part has arrived for ``window`` seconds the whole group is handed to
+    ``on_complete`` on a timer thread.
+    """
+    def __init__(self, on_complete, window=1.0):
+        self.on_complete = on_complete
+        self.window = window
+        self._groups = {}  # media_group_id -> [last_seen, [messages]]
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        with self._lock:
+            group = self._groups.get(message.media_group_id)
+            if group is None:
+                self._groups[message.media_group_id] = [time.monotonic(), [message]]
+                threading.Timer(self.window, self._fire, (message.media_group_id,)).start()
+            else:
+                group[0] = time.monotonic()
+                group[1].append(message)
+
+    def _fire(self, group_id):
+        with self._lock:
+            last_seen, messages = self._groups[group_id]
+            quiet = time.monotonic() - last_seen
+            if quiet < self.window:  # still arriving: check again later
+                threading.Timer(self.window - quiet, self._fire, (group_id,)).start()
+                return
+            del self._groups[group_id]
+        try:
+            self.on_complete(sorted(messages, key=lambda m: m.message_id))
+        except Exception as e:
+            logger.error(f"Album {group_id} failed: {e}")
+
+@timed("handle_album")
+def handle_album(messages):
+    """Stores a whole album: one status message, one forward call, one transaction."""
+    first = messages[0]
+    user_id, chat_id = first.from_user.id, first.chat.id
+    db.add_user(user_id)
+
+    status = bot.reply_to(first, f"⚡ **Processing album ({len(messages)} files)...**")
+    user_channel = db.get_channel(user_id)
+    channels = [user_channel] if user_channel else storage.channels
+
+    try:
+        items, to_forward = [], []
+        for msg in messages:
+            fid, unique, name, mime = file_info(msg)
+            existing = db.find_stored_copy(unique, channels, user_id)
+            items.append([msg, fid, unique, name, mime, existing])
+            if not existing: to_forward.append(msg.message_id)
+
+        stored, storage_channel = {}, None
+        if to_forward:  # the new parts of one album stay together in one channel
+            storage_channel, ids = place_in_storage(user_channel, first.media_group_id,
+                lambda ch: forward_messages(ch, chat_id, to_forward))
+            stored = dict(zip(to_forward, ids))
+
+        rows, results, failed = [], [], []
+        for msg, fid, unique, name, mime, existing in items:
+            if not existing and stored.get(msg.message_id) is None:
+                failed.append(name)
+                continue
+            if existing and existing[2] == user_id:
+                code = existing[0]
+            else:
+                code = generate_code()
+                where = (existing[3], existing[1]) if existing else (storage_channel, stored[msg.message_id])
+                rows.append((code, name, mime, fid, unique, where[1], where[0], user_id, msg.content_type))
+            results.append((name, code))
+        if rows: db.add_files(rows)
+
+        me = bot_me().username
+        txt = f"✅ **Album Saved ({len(results)} files)**\n▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n"
+        txt += "\n".join(f"{i}. `{name}`\n   `https://t.me/{me}?start={code}`" for i, (name, code) in enumerate(results, 1))
+        if len(results) > 1:  # one link that delivers the whole album back as an album
+            bundle = db.create_bundle(generate_bundle_code(), user_id, list(dict.fromkeys(code for _, code in results)))
+            txt += f"\n\n📦 **Whole album:**\n`https://t.me/{me}?start={bundle}`"
+        if failed:
+            txt += f"\n\n⚠️ **Not stored ({len(failed)}):**\n" + "\n".join(f"• `{name}`" for name in failed)
+        first_part, *rest = util.smart_split(txt)  # ten long names can overflow one message
+        bot.edit_message_text(first_part, chat_id, status.message_id)
+        for part in rest: bot.send_message(chat_id, part)
+        log(f"User {user_id} uploaded album {' '.join(code for _, code in results)}")
+
+    except Exception as e:
+        bot.edit_message_text(f"❌ **Error:** {e}", chat_id, status.message_id)
+
+media_groups = MediaGroupCollector(handle_album, MEDIA_GROUP_WINDOW)
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 👥 USER CHANNEL MANAGEMENT
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -399,7 +2433,7 @@ def process_channel_link(message):
         title = message.forward_from_chat.title
         
         # Check permissions
-        mem = bot.get_chat_member(cid, bot.get_me().id)
+        mem = bot.get_chat_member(cid, bot_me().id)
         if mem.status not in ['administrator', 'creator']:
             bot.reply_to(message, "❌ **I am not an admin there.** Promte me first!")
             return
@@ -419,22 +2453,25 @@ def admin_dash(message):
     bot.reply_to(message, "🛡️ **Control Panel**", reply_markup=admin_keyboard())
 
 @bot.callback_query_handler(func=lambda call: True)
+@timed("callback_handler")
 def callback_handler(call):
     uid = call.from_user.id
+    if flood.check(uid, 'callback') != 'ok': return
     
     # ➤ USER CALLBACKS
     if call.data == "help_menu":
         bot.answer_callback_query(call.id)
-        help_command(call.message)
+        bot.reply_to(call.message, help_text(uid))
         return
         
-    if call.data == "my_files":
-        cnt = db.get_user_files_stats(uid)
-        bot.answer_callback_query(call.id, f"You have {cnt} files stored.")
+    if call.data == "my_files" or call.data.startswith("mf:"):
+        txt, kb = my_files_page(uid, None if call.data == "my_files" else call.data)
+        bot.answer_callback_query(call.id)
+        bot.edit_message_text(txt, call.message.chat.id, call.message.message_id, reply_markup=kb)
         return
         
     if call.data == "home":
-        bot.edit_message_text(f"☁️ **Advanced File Store**\nSelect an option:", call.message.chat.id, call.message.message_id, reply_markup=main_menu_keyboard(uid))
+        bot.edit_message_text(HOME_TEXT, call.message.chat.id, call.message.message_id, reply_markup=main_menu_keyboard(uid))
         return
 
     # ➤ ADMIN CALLBACKS (Security Check)
@@ -447,16 +2484,33 @@ def callback_handler(call):
 
     elif call.data == "adm_stats":
         u, f, b = db.get_system_stats()
+        up, down = db.get_daily_stats(hour_bucket()[:10])
+        usage_lines = "\n".join(f"   • `{cid}`: `{n}`" for cid, n in db.get_channel_usage()) or "   • _empty_"
         txt = (
             f"📊 **Live Statistics**\n"
             f"▬▬▬▬▬▬▬▬▬▬▬▬\n"
             f"👥 **Users:** `{u}`\n"
             f"📂 **Files:** `{f}`\n"
             f"🚫 **Banned:** `{b}`\n"
-            f"💾 **DB Size:** Optimized"
+            f"📤 **Uploads Today:** `{up}`\n"
+            f"📥 **Downloads Today:** `{down + downloads.pending}`\n"
+            f"🗄 **Storage Channels:**\n{usage_lines}\n"
+            f"⚡ **File Cache:** `{len(db.file_cache)}` hot, `{db.file_cache.hit_rate:.0%}` hits\n"
+            f"💾 **DB Size:** `{db.get_db_size() / 1048576:.2f} MB`"
         )
         bot.edit_message_text(txt, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
 
+    elif call.data == "adm_top":
+        downloads.flush()
+        now = time.time()
+        top = db.get_top_files(hour_bucket(now)[:10])
+        hourly = db.get_hourly_downloads(hour_bucket(now - 23 * 3600))
+        txt = "🔥 **Top Files Today (UTC)**\n▬▬▬▬▬▬▬▬▬▬▬▬\n"
+        txt += "\n".join(f"{i}. `{name or code}` — `{n}`" for i, (code, name, n) in enumerate(top, 1)) or "_No downloads yet._"
+        txt += "\n\n📈 **Last 24h (per hour)**\n"
+        txt += "\n".join(f"`{bucket[11:]}:00` {'▇' * min(20, max(1, n * 20 // max(c for _, c in hourly)))} `{n}`" for bucket, n in hourly) or "_No data._"
+        bot.edit_message_text(txt, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
+
     elif call.data == "adm_maint_toggle":
         curr = db.get_setting("maintenance_mode")
         new_val = "0" if curr == "1" else "1"
@@ -478,31 +2532,104 @@ def callback_handler(call):
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 def start_broadcast(message):
-    threading.Thread(target=run_broadcast_process, args=(message,)).start()
+    broadcasts.start(message)
 
-def run_broadcast_process(msg):
-    admin_id = msg.from_user.id
-    bot.send_message(admin_id, "🚀 **Broadcast Started...**")
-    
-    users = db.get_all_users()
-    sent, failed = 0, 0
-    start = time.time()
-    
-    for uid in users:
-        try:
-            bot.copy_message(uid, msg.chat.id, msg.message_id)
-            sent += 1
-            time.sleep(0.05) # Rate limit safety
-        except:
-            failed += 1
-            
-    bot.send_message(admin_id, 
-        f"✅ **Broadcast Finished**\n"
-        f"▬▬▬▬▬▬▬▬▬▬▬▬\n"
-        f"👥 Sent: `{sent}`\n"
-        f"❌ Failed: `{failed}`\n"
-        f"⏱ Time: `{round(time.time()-start, 2)}s`"
-    )
+class BroadcastEngine:
+    """Rate-aware, resumable broadcasts.
+
+    Users are walked in user_id order, CHUNK at a time, by a small worker pool
+    sharing one token bucket: the broadcast's share of the global send rate.
+    Job counters and the cursor are saved after every chunk, so a restart
+    resumes where it left off (a chunk may be resent). Broadcast 429s are
+    handled here, not by the outbound scheduler: the whole broadcast backs off.
+    """
+    CHUNK = 100
+
+    def __init__(self, database, workers=4, rate=25, progress_interval=5):
+        self.db = database
+        self.bucket = TokenBucket(rate)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast")
+        self.progress_interval = progress_interval
+
+    def start(self, msg):
+        status = bot.send_message(msg.chat.id, "🚀 **Broadcast Started...**")
+        job_id = self.db.create_broadcast(msg.from_user.id, msg.chat.id, msg.message_id, status.chat.id, status.message_id)
+        self._spawn(job_id)
+
+    def resume_pending(self):
+        for job_id in self.db.get_running_broadcasts():
+            logger.info(f"Resuming broadcast #{job_id}")
+            self._spawn(job_id)
+
+    def _spawn(self, job_id):
+        threading.Thread(target=self.run, args=(job_id,), name=f"broadcast-{job_id}", daemon=True).start()
+
+    def _send(self, from_chat, message_id, uid):
+        for attempt in range(API_MAX_RETRIES + 1):
+            updates.yield_to_foreground(BROADCAST_YIELD_WAIT)
+            self.bucket.acquire()
+            try:
+                with outbound.no_retry():
+                    bot.copy_message(uid, from_chat, message_id)
+                return 'sent'
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is not None and attempt < API_MAX_RETRIES:
+                    self.bucket.pause(wait)  # everyone backs off, this user is retried
+                    continue
+                if is_unreachable(e):
+                    return 'blocked'
+                logger.warning(f"Broadcast to {uid} failed: {e}")
+                return 'failed'
+
+    def _progress(self, chat_id, msg_id, text):
+        try: bot.edit_message_text(text, chat_id, msg_id)
+        except ApiTelegramException as e: logger.debug(f"Progress edit skipped: {e}")
+
+    @timed("run_broadcast_process")
+    def run(self, job_id):
+        (job_id, admin_id, from_chat, message_id, status_chat, status_msg,
+         cursor, sent, failed, blocked, state, started_at) = self.db.get_broadcast(job_id)
+        last_edit = 0
+
+        while True:
+            uids = self.db.get_broadcast_targets(cursor, self.CHUNK)
+            if not uids: break
+
+            results = list(self.pool.map(lambda u: self._send(from_chat, message_id, u), uids))
+            gone = [u for u, r in zip(uids, results) if r == 'blocked']
+            if gone: self.db.mark_blocked(gone)
+            sent += results.count('sent')
+            failed += results.count('failed')
+            blocked += len(gone)
+            cursor = uids[-1]
+            self.db.save_broadcast_progress(job_id, cursor, sent, failed, blocked)
+
+            if time.time() - last_edit >= self.progress_interval:
+                last_edit = time.time()
+                self._progress(status_chat, status_msg,
+                    f"📢 **Broadcast #{job_id} running...**\n"
+                    f"👥 Sent: `{sent}` | ❌ Failed: `{failed}` | 🚷 Blocked: `{blocked}`")
+
+        self.db.save_broadcast_progress(job_id, cursor, sent, failed, blocked, state='done')
+        self._progress(status_chat, status_msg, f"✅ **Broadcast #{job_id} complete.**")
+        bot.send_message(admin_id, 
+            f"✅ **Broadcast Finished**\n"
+            f"▬▬▬▬▬▬▬▬▬▬▬▬\n"
+            f"👥 Sent: `{sent}`\n"
+            f"❌ Failed: `{failed}`\n"
+            f"🚷 Blocked/Deleted: `{blocked}`\n"
+            f"⏱ Time: `{round(time.time()-started_at, 2)}s`"
+        )
+
+broadcasts = BroadcastEngine(db, BROADCAST_WORKERS, BROADCAST_RATE, BROADCAST_PROGRESS_INTERVAL)
+
+def stats_reconcile_loop(interval):
+    """Recounts the stats counters in the background in case they ever drift."""
+    while True:
+        time.sleep(interval)
+        try: db.reconcile()
+        except sqlite3.Error as e: logger.error(f"Stats reconcile failed: {e}")
 
 def admin_delete_logic(message):
     code = message.text.strip()
@@ -510,18 +2637,401 @@ def admin_delete_logic(message):
     bot.reply_to(message, f"🗑 File `{code}` removed from Database.")
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-# 🌐 WEBSERVER KEEP-ALIVE (For Render)
+# ⚡ ASYNC RUNTIME (AsyncTeleBot, RUNTIME=async)
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+class AsyncRuntime:
+    """Serves the hot paths on one event loop instead of a thread per request.
+
+    Deep links, /start, uploads and the menu callbacks are native coroutines
+    on AsyncTeleBot. Everything else (admin flows, next-step replies, channel
+    linking) is handed to the threaded handlers via bot.process_new_updates
+    on a small executor, so those flows keep a single implementation. The
+    native handlers only do the Bot API calls; their gate, DB and storage
+    decisions are the same functions the threaded handlers call.
+    SQLite is only touched from a dedicated executor sized to the pool.
+    """
+    FAST_CALLBACKS = ("home", "help_menu", "my_files")
+
+    def __init__(self, token, db_threads=8, max_inflight=1000, http_limit=100):
+        try:
+            from telebot.async_telebot import AsyncTeleBot
+            from telebot import asyncio_helper
+        except ImportError:
+            print("❌ RUNTIME=async needs aiohttp (pip install aiohttp).")
+            sys.exit(1)
+        asyncio_helper.REQUEST_LIMIT = http_limit  # one shared keep-alive aiohttp session
+        outbound.install_async(asyncio_helper)
+        if apihelper.API_URL:  # follow a custom Bot API server (local server / benchmarks)
+            asyncio_helper.API_URL = apihelper.API_URL
+        if METRICS_ENABLED and not getattr(asyncio_helper._process_request, "timed", False):
+            process_request = asyncio_helper._process_request
+
+            async def timed_request(token, url, *args, **kwargs):
+                start, error = time.perf_counter(), None
+                try:
+                    return await process_request(token, url, *args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _observe_api(url, start, error)
+            timed_request.timed = True
+            asyncio_helper._process_request = timed_request
+        self.abot = AsyncTeleBot(token, parse_mode="Markdown")
+        self.api_error = asyncio_helper.ApiTelegramException
+        self.db_pool = ThreadPoolExecutor(db_threads, thread_name_prefix="db")
+        self.legacy_pool = ThreadPoolExecutor(WORKER_THREADS, thread_name_prefix="legacy")
+        self.max_inflight = max_inflight
+        self.inflight = None
+        self.username = None
+        self._tasks = set()
+
+    async def db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_pool, fn, *args)
+
+    async def setup(self):
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+        self.username = (await self.abot.get_me()).username
+        bot.threaded = False  # legacy handlers run inline on legacy_pool
+
+    async def poll(self, timeout=10, request_timeout=15):
+        """getUpdates loop that confirms a batch only once it fits under max_inflight.
+
+        AsyncTeleBot's own loop advances the offset and then hands the batch
+        to a task nobody awaits, so under sustained load batches pile up in
+        memory, already confirmed to Telegram. Here every update of a batch
+        waits for a slot before the next getUpdates (which confirms it) goes
+        out; the backlog stays on Telegram's side.
+        """
+        offset = None
+        while True:
+            try:
+                batch = await self.abot.get_updates(offset=offset, limit=min(100, self.max_inflight),
+                                                    timeout=timeout, request_timeout=request_timeout)
+            except Exception as e:
+                logger.error(f"Async polling error: {e}")
+                await asyncio.sleep(2)
+                continue
+            for update in batch:
+                await self.inflight.acquire()
+                task = asyncio.create_task(self._route(update))
+                self._tasks.add(task)
+                task.add_done_callback(self._done)
+            if batch: offset = batch[-1].update_id + 1
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        self.inflight.release()
+
+    async def drain(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _route(self, update):
+        try:
+            msg, call = update.message, update.callback_query
+            if msg and msg.chat.id not in bot.next_step_backend.handlers:
+                if msg.content_type == 'text' and util.extract_command(msg.text) == 'start':
+                    return await self.start_command(msg)
+                if msg.content_type in ('document', 'photo', 'video', 'audio'):
+                    return await self.handle_file(msg)
+            elif call and (call.data in self.FAST_CALLBACKS or call.data.startswith("mf:")):
+                return await self.callback_handler(call)
+            await asyncio.get_running_loop().run_in_executor(self.legacy_pool, bot.process_new_updates, [update])
+        except Exception as e:
+            logger.error(f"Async update {update.update_id} failed: {e}")
+
+    async def check_user(self, message):
+        refusal = await self.db(admission, message)
+        if refusal:
+            await self.abot.reply_to(message, refusal)
+        return refusal is None
+
+    @timed("async_start_command")
+    async def start_command(self, message):
+        if not await self.check_user(message): return
+        kind, code, rec = await self.db(start_target, message, self.username)
+        if kind == 'missing':
+            await self.abot.reply_to(message, NOT_FOUND_TEXT)
+        elif kind == 'file':
+            try:
+                await self.abot.copy_message(message.chat.id, rec.channel_id, rec.message_id, caption=delivery_caption(rec.name, self.username))
+                downloads.hit(code)
+            except self.api_error as e:
+                logger.warning(f"Delivery of {code} to {message.chat.id} failed: {e}")
+                await self.abot.reply_to(message, UNAVAILABLE_TEXT)
+        elif kind == 'welcome':
+            await self.abot.send_message(message.chat.id, welcome_text(message.from_user.first_name), reply_markup=main_menu_keyboard(message.from_user.id))
+
+    @timed("async_handle_file")
+    async def handle_file(self, message):
+        if not await self.check_user(message): return
+        info = file_info(message)
+        if not info: return
+        if message.media_group_id:
+            media_groups.add(message)  # stored by the album collector's thread
+            return
+
+        status = await self.abot.reply_to(message, "⚡ **Processing...**")
+        try:
+            user_channel, existing = await self.db(upload_lookup, message.from_user.id, info[1])
+            stored = None if existing else await self.store(user_channel, info[1], message)
+            res_text, kb = await self.db(save_upload, message, info, existing, stored, self.username)
+            await self.abot.edit_message_text(res_text, message.chat.id, status.message_id, reply_markup=kb)
+        except Exception as e:
+            await self.abot.edit_message_text(f"❌ **Error:** {e}", message.chat.id, status.message_id)
+
+    async def store(self, user_channel, key, message):
+        """place_in_storage for one forward on the event loop: (channel, message_id)."""
+        for channel, last in storage_attempts(user_channel, key):
+            try:
+                with outbound.no_retry(not last):
+                    return channel, (await self.abot.forward_message(channel, message.chat.id, message.message_id)).message_id
+            except self.api_error as e:
+                if not storage_failover(channel, e, last): raise
+
+    @timed("async_callback_handler")
+    async def callback_handler(self, call):
+        uid = call.from_user.id
+        if flood.check(uid, 'callback') != 'ok': return
+        chat_id, msg_id = call.message.chat.id, call.message.message_id
+        if call.data == "help_menu":
+            await self.abot.answer_callback_query(call.id)
+            await self.abot.reply_to(call.message, help_text(uid))
+        elif call.data == "home":
+            await self.abot.edit_message_text(HOME_TEXT, chat_id, msg_id, reply_markup=main_menu_keyboard(uid))
+        else:
+            data = None if call.data == "my_files" else call.data
+            txt, kb = await self.db(my_files_page, uid, data, self.username)
+            await self.abot.answer_callback_query(call.id)
+            await self.abot.edit_message_text(txt, chat_id, msg_id, reply_markup=kb)
+
+    async def serve(self):
+        await self.setup()
+        try:
+            await self.poll()
+        finally:
+            await self.drain()
+            await self.abot.close_session()
+
+    def run(self):
+        asyncio.run(self.serve())
+
+# ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# 🌐 WEBSERVER (Health Checks + Webhook)
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-def keep_alive():
-    """Dummy server to satisfy Render Port check"""
+
+class LaneDispatcher:
+    """Priority lanes in front of the handlers, for both polling and webhooks.
+
+    Every update is classified into a lane (deliveries, interactive taps,
+    uploads, admin/background work), each with its own bounded queue. Free
+    workers pick the next lane by smooth weighted round robin over the lanes
+    that have work, so an upload burst gets its share without starving
+    /start <code>; per-lane worker caps keep slow lanes from occupying every
+    thread. Handlers run inline on the workers (bot.threaded is off).
+
+    A full lane blocks the poller (backpressure on getUpdates) or makes the
+    webhook answer 503 so Telegram redelivers later.
+    """
+    FOREGROUND = ('delivery', 'interactive')
+    USER_CALLBACKS = ('help_menu', 'my_files', 'home')
+
+    def __init__(self, weights, max_workers=None, maxsize=1000, workers=8):
+        self.weights = dict(weights)
+        self.caps = {lane: (max_workers or {}).get(lane, workers) for lane in self.weights}
+        self.maxsize = maxsize
+        self.workers = workers
+        self.queues = {lane: deque() for lane in self.weights}
+        self.busy = dict.fromkeys(self.weights, 0)
+        self._credit = dict.fromkeys(self.weights, 0)
+        self._cond = threading.Condition()
+        self._started = False
+
+    def classify(self, update):
+        msg, call = update.message, update.callback_query
+        if call:
+            data = call.data or ""
+            return 'interactive' if data in self.USER_CALLBACKS or data.startswith("mf:") else 'background'
+        if msg:
+            # first: an admin's broadcast content may itself be a photo or document
+            if msg.chat.id in bot.next_step_backend.handlers and msg.from_user.id in ADMIN_LIST:
+                return 'background'  # broadcast content, delete-by-code replies
+            if msg.content_type in ('document', 'photo', 'video', 'audio'):
+                return 'upload'
+            if msg.content_type == 'text' and util.extract_command(msg.text) == 'start' and len(msg.text.split()) > 1:
+                return 'delivery'
+        return 'interactive'
+
+    def put(self, update, block=False):
+        """Queues ``update``; False if its lane is full and ``block`` is off."""
+        lane = self.classify(update)
+        with self._cond:
+            while len(self.queues[lane]) >= self.maxsize:
+                if not block: return False
+                self._cond.wait()
+            self.queues[lane].append((update, time.perf_counter()))
+            self._cond.notify_all()
+        return True
+
+    def put_many(self, new_updates):
+        """Stands in for bot.process_new_updates in the polling loop."""
+        for update in new_updates:
+            bot.last_update_id = max(bot.last_update_id, update.update_id)
+            self.put(update, block=True)
+
+    def _next_lane(self):
+        """Smooth weighted round robin over lanes with work and a free worker slot."""
+        ready = [l for l, q in self.queues.items() if q and self.busy[l] < self.caps[l]]
+        if not ready: return None
+        for l in ready:
+            self._credit[l] += self.weights[l]
+        lane = max(ready, key=self._credit.get)
+        self._credit[lane] -= sum(self.weights[l] for l in ready)
+        return lane
+
+    def _work(self):
+        while True:
+            with self._cond:
+                lane = self._next_lane()
+                while lane is None:
+                    self._cond.wait()
+                    lane = self._next_lane()
+                update, queued_at = self.queues[lane].popleft()
+                self.busy[lane] += 1
+                self._cond.notify_all()
+            if METRICS_ENABLED:
+                metrics.observe("filestore_lane_wait_seconds", (("lane", lane),), time.perf_counter() - queued_at)
+            try:
+                telebot.TeleBot.process_new_updates(bot, [update])
+            except Exception as e:
+                logger.error(f"Update {update.update_id} failed: {e}")
+            finally:
+                with self._cond:
+                    self.busy[lane] -= 1
+                    self._cond.notify_all()
+
+    def foreground_busy(self):
+        return any(self.queues[l] or self.busy[l] for l in self.FOREGROUND if l in self.queues)
+
+    def yield_to_foreground(self, timeout):
+        """Lets background senders (broadcasts) wait while users are being served."""
+        if not self._started: return
+        with self._cond:
+            self._cond.wait_for(lambda: not self.foreground_busy(), timeout)
+
+    def drain(self, timeout):
+        """Waits until every queued update has been handled; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not any(self.queues.values()) and not any(self.busy.values()), timeout)
+
+    def depth(self, lane=None):
+        with self._cond:
+            return len(self.queues[lane]) if lane else sum(len(q) for q in self.queues.values())
+
+    def start(self):
+        bot.threaded = False  # the lane workers are the handler threads
+        self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"update-worker-{i}", daemon=True).start()
+
+    def attach(self):
+        """Routes long polling through the lanes as well."""
+        bot.process_new_updates = self.put_many
+        self.start()
+
+updates = LaneDispatcher(DISPATCH_WEIGHTS, DISPATCH_MAX_WORKERS, UPDATE_QUEUE_SIZE, WORKER_THREADS)
+
+if METRICS_ENABLED:
+    metrics.gauge("filestore_flood_rejected_total", lambda: [((), flood.rejected)], "Updates dropped by per-user flood control", "counter")
+    metrics.gauge("filestore_flood_tracked_users", lambda: [((), len(flood))], "Users held in the flood control table")
+    metrics.gauge("filestore_storage_placed_total", lambda: [((("channel", c),), n) for c, n in storage.placed.items()], "Uploads placed per pooled storage channel", "counter")
+    metrics.gauge("filestore_storage_throttled", lambda: [((("channel", c),), int(t > time.monotonic())) for c, t in storage.throttled_until.items()], "1 while a storage channel is out of rotation")
+    metrics.gauge("filestore_api_wait_seconds_total", lambda: [((), round(outbound.waited, 3))], "Time requests spent waiting for rate-limit tokens or retry_after", "counter")
+    metrics.gauge("filestore_api_retries_total", lambda: [((), outbound.retries)], "Requests retried after a 429", "counter")
+    metrics.gauge("filestore_api_chat_buckets", lambda: [((), len(outbound._chats))], "Chats with a live rate-limit bucket")
+    metrics.gauge("filestore_update_queue_depth", lambda: [((("lane", l),), updates.depth(l)) for l in updates.queues], "Updates waiting for a worker")
+    metrics.gauge("filestore_lane_busy_workers", lambda: [((("lane", l),), n) for l, n in updates.busy.items()], "Workers running each lane")
+    metrics.describe("filestore_lane_wait_seconds", "histogram", "Time updates spent queued, by lane")
+    metrics.gauge("filestore_downloads_pending", lambda: [((), downloads.pending)], "Downloads not yet flushed to SQLite")
+    metrics.gauge("filestore_log_queue_depth", lambda: [((), log_shipper.queue.qsize())], "Log lines waiting to be shipped")
+    metrics.gauge("filestore_uptime_seconds", lambda: [((), round(time.time() - STARTED_AT))], "Process uptime")
+
+class BotRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive for Telegram's webhook connections
+    disable_nagle_algorithm = True  # headers and body go out in separate writes; don't wait for delayed ACKs
+
+    def log_message(self, fmt, *args):
+        logger.debug("HTTP " + fmt % args)
+
+    def _reply(self, code, body=b"", content_type="text/plain; charset=utf-8", headers=()):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers: self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics" and METRICS_ENABLED:
+            return self._reply(200, metrics.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+        if self.path in ("/", "/health"):
+            body = json.dumps({"status": "ok", "mode": RUN_MODE, "queued": updates.depth(),
+                               "uptime": round(time.time() - STARTED_AT)}).encode()
+            return self._reply(200, body, "application/json")
+        self._reply(404, b"not found")
+
+    def do_HEAD(self):
+        self._reply(200 if self.path in ("/", "/health") else 404)
+
+    def do_POST(self):
+        # Reject before reading: an unread body would desync keep-alive, so drop the connection too
+        if self.path != WEBHOOK_PATH:
+            self.close_connection = True
+            return self._reply(404, b"not found")
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, WEBHOOK_SECRET):
+            self.close_connection = True
+            return self._reply(403, b"forbidden")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= WEBHOOK_MAX_BODY:
+            self.close_connection = True
+            return self._reply(413, b"too large")
+        body = self.rfile.read(length) if length else b""
+        try:
+            update = types.Update.de_json(body.decode("utf-8"))
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400, b"bad update")
+        if not updates.put(update):
+            return self._reply(503, b"busy", headers=[("Retry-After", "1")])
+        self._reply(200, b"ok")
+
+def keep_alive(port=None):
+    """Serves /health (Render's port check) and, in webhook mode, Telegram updates"""
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind(('0.0.0.0', int(os.environ.get("PORT", 8080))))
-        sock.listen(1)
-        print("✅ Dummy Server Listening on Port 8080")
+        server = ThreadingHTTPServer(('0.0.0.0', port or int(os.environ.get("PORT", 8080))), BotRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="http", daemon=True).start()
+        print(f"✅ HTTP Server Listening on Port {server.server_port}")
+        return server
     except Exception as e:
         print(f"⚠️ Server Bind Error: {e}")
 
+def start_webhook():
+    """Switches to webhook delivery; returns False if Telegram refused it."""
+    try:
+        bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                        max_connections=WEBHOOK_MAX_CONNECTIONS, drop_pending_updates=False)
+    except Exception as e:
+        print(f"⚠️ Webhook Setup Error: {e}")
+        return False
+    updates.start()
+    return True
+
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 # 🚀 MAIN LOOP
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -532,9 +3042,50 @@ if __name__ == "__main__":
 
     print("🔥 Bot 2.0 Starting...")
     
-    # Start Dummy Server for Render
-    threading.Thread(target=keep_alive, daemon=True).start()
+    # Health checks (+ webhook endpoint) for Render
+    http_server = keep_alive()
+
+    def on_sigterm(signum, frame):
+        """Render stops the old instance with SIGTERM on every redeploy, which skips atexit.
+
+        Stop taking updates and let the queued ones finish (their audit lines
+        and download hits), then exit through SystemExit so the atexit hooks
+        ship the log lines, flush the write-behind buffers and the last journal chunk.
+        """
+        print("🛑 SIGTERM: shutting down")
+        if RUN_MODE == "polling": bot.stop_polling()
+        if http_server: http_server.shutdown()  # webhook deliveries now fail and Telegram retries them
+        if updates._started and not updates.drain(SHUTDOWN_GRACE):
+            logger.warning(f"Shutdown: {updates.depth()} queued updates not handled")
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    # Snapshots + change journal (snapshot right away so replayed journal chunks can be pruned)
+    if snapshots:
+        journal.start()
+        snapshots.start(now=True)
+
+    # Pick up broadcasts interrupted by the last restart
+    broadcasts.resume_pending()
+
+    threading.Thread(target=stats_reconcile_loop, args=(STATS_RECONCILE_INTERVAL,), daemon=True).start()
+
+    if RUNTIME == "async":
+        RUN_MODE = "async"
+        print("⚡ Async Runtime (AsyncTeleBot, long polling)")
+        AsyncRuntime(BOT_TOKEN, DB_POOL_SIZE, ASYNC_MAX_INFLIGHT, ASYNC_HTTP_LIMIT).run()
+        sys.exit()
+
+    if WEBHOOK_URL and start_webhook():
+        RUN_MODE = "webhook"
+        print(f"🪝 Webhook Mode: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        threading.Event().wait()
 
+    RUN_MODE = "polling"
+    if WEBHOOK_URL:
+        bot.remove_webhook()  # fallback: getUpdates is refused while a webhook is set
+    updates.attach()
     while True:
         try:
             bot.infinity_polling(timeout=10, long_polling_timeout=5)